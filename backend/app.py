@@ -1,100 +1,154 @@
-from flask import Flask, request, send_file, jsonify, send_from_directory
+from flask import Flask, Response, request, send_file, jsonify, send_from_directory
 import cv2
 import numpy as np
 import os
-import torch
-from basicsr.archs.ddcolor_arch import DDColor
-import torch.nn.functional as F
+from colorization_engine import BACKENDS, DEVICE, PRECISIONS, ImageColorizationPipeline
+import hashlib
+import io
+import re
+import shutil
 import time
+import uuid
 import argparse
+import hmac
+import signal
+import threading
+from concurrent.futures import Future
+from stream_batcher import StreamBatcher
+from pipelined_executor import PipelinedExecutor
+from fair_scheduler import FairScheduler
+from model_reloader import ModelReloader
+from job_queue import JobQueue
+from job_control import CancelToken, CancellationMetrics, JobCancelled, client_disconnected
+from result_store import ResultStore
+from segmented_video import SegmentedVideoWriter
+from static_frames import StaticFrameFilter, StaticFrameMetrics
+from upload_ingest import ProgressiveVideoReader, UploadIngest, UploadTooLarge
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 app = Flask(__name__)
+sock = Sock(app) if Sock is not None else None
 
 # Define the model path - Update this to your model path
 MODEL_PATH = "./pretrained_model.pt"
 
+# Token required by the /admin endpoints; without one they only answer local requests
+ADMIN_TOKEN = None
+
 # Default server configuration
 DEFAULT_HOST = "0.0.0.0"  # Listen on all interfaces
 DEFAULT_PORT = 5000       # Use a common Flask port
 
-# Check if GPU is available
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Job-scoped result storage
+RESULTS_DIR = "results"
+RESULT_TTL_SECONDS = 3600          # results expire this long after their last fetch
+RESULT_QUOTA_BYTES = 10 * 1024 ** 3  # least recently used results are evicted above this
+FINISHED_JOBS_KEPT = 1000           # statuses of finished jobs without stored results that are remembered
+
+# Durable queue for bulk jobs run by worker.py processes; both must see the same paths
+QUEUE_PATH = "jobs.db"
+QUEUE_UPLOADS_DIR = "queued_uploads"
+
+# Segmented (progressive) video output
+SEGMENT_DURATION = 4.0  # seconds per playlist segment
+SEGMENT_CLIENT_IDLE_TIMEOUT = 60.0  # a segmented job is cancelled once its client stops polling this long
+
+# Fair-share scheduling of image requests across clients (keyed by X-API-Key, else IP)
+TENANT_MAX_CONCURRENCY = 2  # requests of one client in the executor at a time
+TENANT_WEIGHTS = {}         # tenant id -> weight (default 1.0)
+
+# Job ids accepted in URLs
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Client-chosen job ids; long enough not to be guessed, as they let anyone cancel the job
+CLIENT_JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+# Video frames go through the scheduler's bulk lane this many at a time
+VIDEO_BATCH_FRAMES = 4
+
+# Video frames whose thumbnail L differs from the last colorized frame by at most this much
+# (mean absolute difference, L in [0, 100]) reuse its colors instead of running the model; 0 disables
+STATIC_FRAME_THRESHOLD = 1.0
+
+# Size cap for streamed video uploads
+MAX_UPLOAD_BYTES = 2048 * 1024 * 1024
+
+# Execution backend of the model: eager, compile, export or quantized (see colorization_engine.py)
+ENGINE_BACKEND = "eager"
+
+# Inference precision: fp32, or bf16/fp16 autocast of the encoder and color decoder
+# (check the ab error on your images with colorization_engine.py first)
+ENGINE_PRECISION = "fp32"
+
+# Run the model in the channels-last (NHWC) memory format; usually faster on recent CPUs and GPUs
+ENGINE_CHANNELS_LAST = False
+
 print(f"Using device: {DEVICE}")
 
-# Initialize the colorization pipeline
-class ImageColorizationPipeline:
-    def __init__(self, model_path, input_size=256, model_size='large'):
-        self.input_size = input_size
-        self.device = DEVICE  # Use GPU if available
-
-        if model_size == 'tiny':
-            self.encoder_name = 'convnext-t'
-        else:
-            self.encoder_name = 'convnext-l'
-
-        self.decoder_type = "MultiScaleColorDecoder"
-
-        if self.decoder_type == 'MultiScaleColorDecoder':
-            self.model = DDColor(
-                encoder_name=self.encoder_name,
-                decoder_name='MultiScaleColorDecoder',
-                input_size=[self.input_size, self.input_size],
-                num_output_channels=2,
-                last_norm='Spectral',
-                do_normalize=False,
-                num_queries=100,
-                num_scales=3,
-                dec_layers=9,
-            ).to(self.device)
-        else:
-            self.model = DDColor(
-                encoder_name=self.encoder_name,
-                decoder_name='SingleColorDecoder',
-                input_size=[self.input_size, self.input_size],
-                num_output_channels=2,
-                last_norm='Spectral',
-                do_normalize=False,
-                num_queries=256,
-            ).to(self.device)
-
-        self.model.load_state_dict(
-            torch.load(model_path, map_location=self.device)['params'],
-            strict=False)
-        self.model.eval()
-
-    @torch.no_grad()
-    def process(self, img):
-        start_time = time.time()
-
-        self.height, self.width = img.shape[:2]
-
-        img = (img / 255.0).astype(np.float32)
-        orig_l = cv2.cvtColor(img, cv2.COLOR_BGR2Lab)[:, :, :1]  # (h, w, 1)
-
-        img_resized = cv2.resize(img, (self.input_size, self.input_size))
-        img_l = cv2.cvtColor(img_resized, cv2.COLOR_BGR2Lab)[:, :, :1]
-        img_gray_lab = np.concatenate((img_l, np.zeros_like(img_l), np.zeros_like(img_l)), axis=-1)  # Ensure 3 channels
-        img_gray_rgb = cv2.cvtColor(img_gray_lab, cv2.COLOR_LAB2RGB)
-
-        tensor_gray_rgb = torch.from_numpy(img_gray_rgb.transpose((2, 0, 1))).float().unsqueeze(0).to(self.device)
-        output_ab = self.model(tensor_gray_rgb).cpu()  # (1, 2, self.height, self.width)
-
-        output_ab_resize = F.interpolate(output_ab, size=(self.height, self.width))[0].float().numpy().transpose(1, 2, 0)
-        output_lab = np.concatenate((orig_l, output_ab_resize), axis=-1)
-        output_bgr = cv2.cvtColor(output_lab, cv2.COLOR_LAB2BGR)
-
-        output_img = (output_bgr * 255.0).round().astype(np.uint8)
-
-        end_time = time.time()
-        print(f"Time taken for colorization: {end_time - start_time:.2f} seconds")
-
-        return output_img
+def build_pipeline(model_path):
+    return ImageColorizationPipeline(model_path=model_path, input_size=512, model_size='large', backend=ENGINE_BACKEND,
+                                     precision=ENGINE_PRECISION, channels_last=ENGINE_CHANNELS_LAST)
 
 # Initialize the colorization pipeline
-colorizer = ImageColorizationPipeline(model_path=MODEL_PATH, input_size=512, model_size='large')
+colorizer = build_pipeline(MODEL_PATH)
+
+# Image requests flow through separate pre-processing, inference and post-processing workers
+executor = PipelinedExecutor(colorizer, pre_workers=2, post_workers=2, max_batch_size=4)
+
+# Requests wait here, per client, before they reach the executor
+scheduler = FairScheduler(executor, weights=TENANT_WEIGHTS, max_concurrency=TENANT_MAX_CONCURRENCY,
+                          max_outstanding=2 * executor.max_batch_size)
+
+def tenant_id(api_key, remote_addr):
+    """Scheduler key of a client; API keys are hashed so they never show up in stats."""
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    return f"ip:{remote_addr}"
+
+# Live streams share one batcher, so concurrent streams ride the same forward pass
+stream_batcher = StreamBatcher(colorizer, max_batch_size=8)
+
+def swap_pipeline(pipeline):
+    """Makes `pipeline` the serving one; requests already in the model finish on the old one."""
+    global colorizer
+    old = colorizer
+    colorizer = pipeline
+    executor.pipeline = pipeline
+    stream_batcher.pipeline = pipeline
+    return old
+
+# New checkpoints are loaded and checked in the background, then swapped in
+model_reloader = ModelReloader(build_pipeline, swap_pipeline)
+
+# Lab L value of every 8-bit gray level, so raw gray buffers skip the BGR->Lab conversion
+GRAY_TO_L = cv2.cvtColor(
+    np.repeat(np.arange(256, dtype=np.float32) / 255.0, 3).reshape(1, 256, 3), cv2.COLOR_BGR2Lab)[0, :, 0]
+
+RAW_PIXEL_FORMATS = {"uint8": np.uint8, "float32": np.float32}
+RAW_OUTPUT_FORMATS = {"raw", "png", "jpg"}
+
+def decode_raw_l(buffer, width, height, pixel_format):
+    """Turns a raw single-channel buffer into a float32 Lab L image.
+
+    uint8 buffers hold gray levels (0-255), float32 buffers hold Lab L directly (0-100).
+    """
+    dtype = RAW_PIXEL_FORMATS[pixel_format]
+    expected = width * height * np.dtype(dtype).itemsize
+    if len(buffer) != expected:
+        raise ValueError(f"Expected {expected} bytes for a {width}x{height} {pixel_format} buffer, got {len(buffer)}.")
+
+    pixels = np.frombuffer(buffer, dtype=dtype).reshape(height, width)
+    if dtype == np.uint8:
+        return GRAY_TO_L[pixels]
+    if not np.isfinite(pixels).all() or pixels.min() < 0 or pixels.max() > 100:
+        raise ValueError("float32 buffers must hold finite Lab L values between 0 and 100.")
+    return np.ascontiguousarray(pixels)
 
 # Helper functions for video processing
-def extract_frames(video_path, output_dir):
+def extract_frames(video_path, output_dir, token=None):
     """Extracts frames from a video and saves them as .jpg files."""
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -105,6 +159,8 @@ def extract_frames(video_path, output_dir):
 
     frame_number = 0
     while True:
+        if token is not None:
+            token.check()
         ret, frame = cap.read()
         if not ret:
             break
@@ -117,26 +173,69 @@ def extract_frames(video_path, output_dir):
     print(f"Extracted {frame_number} frames to {output_dir}.")
     return frame_number
 
-def colorize_directory(input_dir, output_dir):
-    """Colorizes all .jpg images in a directory."""
+def colorize_frames_bulk(frames, tenant, token=None, frame_filter=None):
+    """Colorizes frames through the scheduler's bulk lane, VIDEO_BATCH_FRAMES at a time.
+
+    Every batch boundary is a preemption point: interactive requests queued in
+    the meantime reach the model before the next batch of frames, and a
+    cancelled `token` stops the job there. Frames that `frame_filter` flags as
+    duplicates skip the model and take the ab prediction of the last frame that ran it.
+    """
+    batch = []  # futures, or the frame itself for duplicates
+    last_ab = None
+
+    def resolve(entry):
+        nonlocal last_ab
+        if isinstance(entry, Future):
+            output_img, last_ab = entry.result()
+            return output_img
+        return colorizer.apply_ab(entry, last_ab)
+
+    try:
+        for frame in frames:
+            if token is not None and not batch:
+                token.check()
+            if frame_filter is not None and frame_filter.is_duplicate(frame):
+                batch.append(frame)
+            else:
+                batch.append(scheduler.submit(tenant, frame, priority="bulk", with_ab=True))
+            if len(batch) == VIDEO_BATCH_FRAMES:
+                for entry in batch:
+                    yield resolve(entry)
+                batch = []
+        for entry in batch:
+            yield resolve(entry)
+    finally:
+        # Frames still queued when the loop is abandoned never reach the model
+        discarded = sum(entry.cancel() for entry in batch if isinstance(entry, Future))
+        if token is not None:
+            token.frames_discarded += discarded
+
+def colorize_directory(input_dir, output_dir, tenant="video", token=None, frame_filter=None):
+    """Colorizes all .jpg images in a directory, in name order."""
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    frame_files = [f for f in os.listdir(input_dir) if f.endswith('.jpg')]
-    for frame_file in frame_files:
-        input_path = os.path.join(input_dir, frame_file)
-        img = cv2.imread(input_path)
-        if img is None:
-            print(f"Error: Unable to read image {input_path}.")
-            continue
-
-        colorized_img = colorizer.process(img)
-        output_path = os.path.join(output_dir, f"colorized_{frame_file}")
+    frame_files = sorted(f for f in os.listdir(input_dir) if f.endswith('.jpg'))
+    read_files = []
+
+    def read_frames():
+        for frame_file in frame_files:
+            input_path = os.path.join(input_dir, frame_file)
+            img = cv2.imread(input_path)
+            if img is None:
+                print(f"Error: Unable to read image {input_path}.")
+                continue
+            read_files.append(frame_file)
+            yield img
+
+    for i, colorized_img in enumerate(colorize_frames_bulk(read_frames(), tenant, token, frame_filter)):
+        output_path = os.path.join(output_dir, f"colorized_{read_files[i]}")
         cv2.imwrite(output_path, colorized_img)
 
     print(f"Colorized frames saved to {output_dir}.")
 
-def combine_frames_to_video(frame_dir, output_video_path, fps=30):
+def combine_frames_to_video(frame_dir, output_video_path, fps=30, token=None):
     """Combines .jpg frames into a .mp4 video."""
     frame_files = sorted([f for f in os.listdir(frame_dir) if f.endswith('.jpg')])
     if not frame_files:
@@ -152,6 +251,10 @@ def combine_frames_to_video(frame_dir, output_video_path, fps=30):
     video_writer = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
 
     for frame_file in frame_files:
+        if token is not None and token.cancelled:
+            video_writer.release()
+            os.remove(output_video_path)
+            token.check()
         frame_path = os.path.join(frame_dir, frame_file)
         frame = cv2.imread(frame_path)
         if frame is None:
@@ -162,74 +265,481 @@ def combine_frames_to_video(frame_dir, output_video_path, fps=30):
     video_writer.release()
     print(f"Video saved to {output_video_path}.")
 
+# Status of video jobs, keyed by job id
+video_jobs = {}
+job_tokens = {}      # job id -> CancelToken of a running job
+job_last_seen = {}   # job id -> last time its client fetched the playlist, a segment or the status
+cancellation_metrics = CancellationMetrics()
+static_frame_metrics = StaticFrameMetrics()
+
+def forget_expired(job_id):
+    """Drops the status of a job whose results were evicted; queue jobs are marked expired in the queue."""
+    if video_jobs.pop(job_id, None) is None:
+        job_queue.expire(job_id)
+
+def forget_finished_jobs():
+    """Drops the oldest statuses of finished jobs without stored results beyond FINISHED_JOBS_KEPT.
+
+    Jobs with results are forgotten when the result store evicts them.
+    """
+    if len(video_jobs) <= FINISHED_JOBS_KEPT:
+        return
+    finished = [job_id for job_id in list(video_jobs)
+                if job_id not in job_tokens and video_jobs.get(job_id, {}).get("status") not in ("running", "uploading")
+                and not result_store.exists(job_id)]
+    for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+        video_jobs.pop(job_id, None)
+
+def queue_job_active(job_id):
+    """Whether a queue job is waiting for or held by a worker, which may be writing its results."""
+    job = job_queue.get(job_id)
+    return job is not None and job["status"] in ("queued", "leased")
+
+result_store = ResultStore(RESULTS_DIR, ttl_seconds=RESULT_TTL_SECONDS, quota_bytes=RESULT_QUOTA_BYTES,
+                           on_evict=forget_expired, is_active=queue_job_active)
+
+job_queue = JobQueue(QUEUE_PATH)
+
+def new_job(job_id=None, probe=None):
+    """Registers a video job and returns its id and cancel token."""
+    job_id = job_id or uuid.uuid4().hex
+    token = CancelToken(probe=probe)
+    forget_finished_jobs()
+    video_jobs[job_id] = {"status": "running", "frames": 0}
+    job_tokens[job_id] = token
+    return job_id, token
+
+def segment_client_gone(job_id):
+    """Whether the client of a segmented job stopped polling, i.e. went away."""
+    last_seen = job_last_seen.get(job_id)
+    return last_seen is not None and time.time() - last_seen > SEGMENT_CLIENT_IDLE_TIMEOUT
+
+def iter_video_frames(cap):
+    """Yields frames from an opened cv2.VideoCapture and releases it at the end."""
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+def colorize_video_segmented(job_id, frames, segment_writer, input_video_path, tenant):
+    """Colorizes `frames` into playlist segments; runs in a background thread."""
+    token = job_tokens[job_id]
+    frame_filter = StaticFrameFilter(STATIC_FRAME_THRESHOLD)
+    try:
+        for colorized_frame in colorize_frames_bulk(frames, tenant, token, frame_filter):
+            segment_writer.write(colorized_frame)
+
+        segment_writer.close()
+        video_jobs[job_id]["status"] = "done"
+        result_store.finish(job_id)
+        print(f"Segmented video saved to {segment_writer.output_dir}.")
+    except JobCancelled as e:
+        print(f"Job {job_id} cancelled: {e}")
+        video_jobs[job_id].update({"status": "cancelled", "reason": str(e)})
+        cancellation_metrics.record(str(e), segment_writer.frame_count, token.frames_discarded)
+        segment_writer.close()
+        result_store.remove(job_id)
+    except Exception as e:
+        print(f"Error: {e}")
+        video_jobs[job_id].update({"status": "failed", "error": str(e)})
+        # Release the open segment and end the playlist before the directory goes
+        try:
+            segment_writer.close()
+        except Exception as close_error:
+            print(f"Error: could not close the segments of job {job_id}: {close_error}")
+        result_store.remove(job_id)
+    finally:
+        video_jobs[job_id].update({"frames": segment_writer.frame_count, "framesSkipped": frame_filter.skipped})
+        static_frame_metrics.record(frame_filter)
+        job_tokens.pop(job_id, None)
+        job_last_seen.pop(job_id, None)
+        os.remove(input_video_path)
+
+def start_segmented_video_job(uploaded_file, tenant):
+    """Starts colorizing an uploaded video into segments and returns the job id."""
+    job_id, _ = new_job(probe=lambda: segment_client_gone(job_id))
+    input_video_path = f"uploaded_video_{job_id}.mp4"
+    uploaded_file.save(input_video_path)
+
+    cap = cv2.VideoCapture(input_video_path)
+    if not cap.isOpened():
+        os.remove(input_video_path)
+        video_jobs[job_id]["status"] = "failed"
+        job_tokens.pop(job_id, None)
+        raise ValueError(f"Error: Could not open video {input_video_path}.")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    segment_writer = SegmentedVideoWriter(result_store.create(job_id), fps, SEGMENT_DURATION)
+
+    threading.Thread(
+        target=colorize_video_segmented,
+        args=(job_id, iter_video_frames(cap), segment_writer, input_video_path, tenant),
+        daemon=True).start()
+    return job_id
+
+def run_streamed_video_job(job_id, ingest, tenant):
+    """Colorizes an upload into segments while it is still being received."""
+    reader = ProgressiveVideoReader(ingest)
+    try:
+        fps = reader.open()
+    except Exception as e:
+        print(f"Error: {e}")
+        video_jobs[job_id].update({"status": "failed", "error": str(e)})
+        job_tokens.pop(job_id, None)
+        if os.path.exists(ingest.path):
+            os.remove(ingest.path)
+        return
+
+    video_jobs[job_id]["status"] = "running"
+    segment_writer = SegmentedVideoWriter(result_store.create(job_id), fps, SEGMENT_DURATION)
+    colorize_video_segmented(job_id, reader, segment_writer, ingest.path, tenant)
+
 @app.route("/colorize", methods=["POST"])
 def colorize():
     try:
-        # Save the uploaded file
-        uploaded_file = request.files["file"]
-        input_path = "uploaded_image.JPEG"
-        uploaded_file.save(input_path)
-
-        # Read the image
-        img = cv2.imread(input_path)
+        # Decode the upload in memory, so concurrent requests never share a file
+        data = request.files["file"].read()
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
         if img is None:
             return jsonify({"error": "Unable to read image file."}), 400
 
-        # Colorize the image
-        output_img = colorizer.process(img)
-
-        # Save the colorized image
-        output_path = "colorized_image.png"
-        cv2.imwrite(output_path, output_img)
+        # Colorize the image and encode it as PNG in the post-processing stage
+        tenant = tenant_id(request.headers.get("X-API-Key"), request.remote_addr)
+        output_png = scheduler.submit(tenant, img, encode=".png").result()
 
         # Return the colorized image
-        return send_file(output_path, mimetype="image/png")
+        return send_file(io.BytesIO(output_png), mimetype="image/png")
 
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": "An error occurred while processing the image."}), 500
 
+@app.route("/colorize-raw", methods=["POST"])
+def colorize_raw():
+    """Colorizes a raw L buffer; dimensions and formats come from the X-* headers."""
+    try:
+        width = int(request.headers["X-Width"])
+        height = int(request.headers["X-Height"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "X-Width and X-Height headers are required."}), 400
+
+    pixel_format = request.headers.get("X-Pixel-Format", "uint8")
+    output_format = request.headers.get("X-Output-Format", "raw")
+    if width <= 0 or height <= 0:
+        return jsonify({"error": "X-Width and X-Height must be positive."}), 400
+    if pixel_format not in RAW_PIXEL_FORMATS:
+        return jsonify({"error": f"Unsupported X-Pixel-Format: {pixel_format}."}), 400
+    if output_format not in RAW_OUTPUT_FORMATS:
+        return jsonify({"error": f"Unsupported X-Output-Format: {output_format}."}), 400
+
+    try:
+        l_channel = decode_raw_l(request.get_data(), width, height, pixel_format)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # Through the scheduler like /colorize, so the executor's inference thread owns the model
+        tenant = tenant_id(request.headers.get("X-API-Key"), request.remote_addr)
+        output_img = scheduler.submit(tenant, l_channel).result()
+
+        if output_format == "raw":
+            # Interleaved BGR, 3 bytes per pixel
+            return Response(output_img.tobytes(), mimetype="application/octet-stream",
+                            headers={"X-Width": str(width), "X-Height": str(height), "X-Pixel-Format": "bgr24"})
+
+        ok, encoded = cv2.imencode(f".{output_format}", output_img)
+        if not ok:
+            return jsonify({"error": "Unable to encode the colorized image."}), 500
+        mimetype = "image/png" if output_format == "png" else "image/jpeg"
+        return Response(encoded.tobytes(), mimetype=mimetype)
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": "An error occurred while processing the image."}), 500
+
+def stream_frames(ws):
+    """WebSocket loop: receives encoded grayscale frames and sends back colorized JPEGs."""
+    stream_id = uuid.uuid4().hex
+    stream_batcher.open_stream(stream_id)
+
+    def send_frame(output_img):
+        ok, encoded = cv2.imencode(".jpg", output_img)
+        if ok:
+            ws.send(encoded.tobytes())
+
+    try:
+        while True:
+            data = ws.receive()
+            if data is None:
+                break
+            if isinstance(data, str):  # frames must be sent as binary messages
+                continue
+            frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                print(f"Error: Unable to decode frame on stream {stream_id}.")
+                continue
+            stream_batcher.submit(stream_id, frame, send_frame)
+    finally:
+        stream_batcher.close_stream(stream_id)
+
+if sock is not None:
+    sock.route("/stream")(stream_frames)
+else:
+    print("flask-sock is not installed; the /stream WebSocket endpoint is disabled.")
+
+@app.route("/executor/stats", methods=["GET"])
+def executor_stats():
+    return jsonify(executor.stats())
+
+@app.route("/scheduler/stats", methods=["GET"])
+def scheduler_stats():
+    return jsonify(scheduler.stats())
+
+@app.route("/stream/stats", methods=["GET"])
+def stream_stats():
+    return jsonify(stream_batcher.stats())
+
 @app.route("/colorize-video", methods=["POST"])
 def colorize_video():
     try:
-        # Save the uploaded video
         uploaded_file = request.files["file"]
-        input_video_path = "uploaded_video.mp4"
+        tenant = tenant_id(request.headers.get("X-API-Key"), request.remote_addr)
+
+        # Segmented mode returns right away; the playlist grows as segments complete
+        if request.form.get("mode") == "segmented":
+            job_id = start_segmented_video_job(uploaded_file, tenant)
+            server_url = request.host_url.rstrip('/')
+            return jsonify({
+                "jobID": job_id,
+                "playlistURL": f"{server_url}/results/{job_id}/playlist.m3u8",
+            }), 202, {"Content-Type": "application/json"}
+
+        # A client-chosen jobID lets the client abort the job with DELETE /jobs/<jobID>
+        job_id = request.form.get("jobID")
+        # IDs of earlier runs are refused too, so a reused ID can never write into or remove their results
+        if job_id is not None and (not CLIENT_JOB_ID_PATTERN.match(job_id) or job_id in video_jobs
+                                   or result_store.exists(job_id)):
+            return jsonify({"error": "Invalid or duplicate jobID."}), 400, {"Content-Type": "application/json"}
+        client_socket = request.environ.get("werkzeug.socket")
+        job_id, token = new_job(job_id, probe=lambda: client_disconnected(client_socket))
+
+        input_video_path = f"uploaded_video_{job_id}.mp4"
+        frames_dir = f"extracted_frames_{job_id}"
+        colorized_frames_dir = f"colorized_frames_{job_id}"
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500, {"Content-Type": "application/json"}
+
+    frame_count = 0
+    frame_filter = StaticFrameFilter(STATIC_FRAME_THRESHOLD)
+    try:
+        # Save the uploaded video
         uploaded_file.save(input_video_path)
 
         # Extract frames from the video
-        frames_dir = "extracted_frames"
-        frame_count = extract_frames(input_video_path, frames_dir)
+        frame_count = extract_frames(input_video_path, frames_dir, token)
 
         # Colorize the frames
-        colorized_frames_dir = "colorized_frames"
-        colorize_directory(frames_dir, colorized_frames_dir)
+        colorize_directory(frames_dir, colorized_frames_dir, tenant, token, frame_filter)
 
-        # Combine colorized frames into a video
-        output_video_path = "colorized_video.mp4"
-        combine_frames_to_video(colorized_frames_dir, output_video_path)
-
-        # Clean up temporary files
-        for file in os.listdir(frames_dir):
-            os.remove(os.path.join(frames_dir, file))
-        os.rmdir(frames_dir)
-        for file in os.listdir(colorized_frames_dir):
-            os.remove(os.path.join(colorized_frames_dir, file))
-        os.rmdir(colorized_frames_dir)
+        # Combine colorized frames into a video in the job's result directory
+        output_video_path = os.path.join(result_store.create(job_id), "colorized_video.mp4")
+        combine_frames_to_video(colorized_frames_dir, output_video_path, token=token)
+        result_store.finish(job_id)
+        video_jobs[job_id].update({"status": "done", "frames": frame_count, "framesSkipped": frame_filter.skipped})
 
         # Get server URL from request
         server_url = request.host_url.rstrip('/')
-        full_url = f"{server_url}/colorized_video.mp4"
+        full_url = f"{server_url}/results/{job_id}/colorized_video.mp4"
         
         return jsonify({"outputURL": full_url}), 200, {"Content-Type": "application/json"}
 
+    except JobCancelled as e:
+        print(f"Job {job_id} cancelled: {e}")
+        colorized = len(os.listdir(colorized_frames_dir)) if os.path.isdir(colorized_frames_dir) else 0
+        video_jobs[job_id].update({"status": "cancelled", "reason": str(e), "frames": colorized})
+        cancellation_metrics.record(str(e), colorized, max(frame_count - colorized, token.frames_discarded))
+        result_store.remove(job_id)
+        return jsonify({"error": "The job was cancelled."}), 409, {"Content-Type": "application/json"}
+
     except Exception as e:
         print(f"Error: {e}")
+        video_jobs[job_id].update({"status": "failed", "error": str(e)})
+        result_store.remove(job_id)
         return jsonify({"error": str(e)}), 500, {"Content-Type": "application/json"}
 
-@app.route("/colorized_video.mp4", methods=["GET"])
-def get_colorized_video():
-    return send_from_directory(".", "colorized_video.mp4")
+    finally:
+        static_frame_metrics.record(frame_filter)
+
+        # Clean up temporary files
+        job_tokens.pop(job_id, None)
+        shutil.rmtree(frames_dir, ignore_errors=True)
+        shutil.rmtree(colorized_frames_dir, ignore_errors=True)
+        if os.path.exists(input_video_path):
+            os.remove(input_video_path)
+
+@app.route("/colorize-video-stream", methods=["POST"])
+def colorize_video_stream():
+    """Takes the raw video as the request body and colorizes it into segments while it uploads."""
+    job_id, _ = new_job(probe=lambda: segment_client_gone(job_id))
+    ingest = UploadIngest(request.stream, f"uploaded_video_{job_id}.mp4",
+                          content_length=request.content_length, max_bytes=MAX_UPLOAD_BYTES)
+    video_jobs[job_id]["status"] = "uploading"
+    tenant = tenant_id(request.headers.get("X-API-Key"), request.remote_addr)
+    threading.Thread(target=run_streamed_video_job, args=(job_id, ingest, tenant), daemon=True).start()
+
+    try:
+        ingest.run()
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413, {"Content-Type": "application/json"}
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": "The upload was interrupted."}), 400, {"Content-Type": "application/json"}
+    finally:
+        video_jobs[job_id]["ingest"] = ingest.stats()
+
+    print(f"Ingested {ingest.bytes_written} bytes at {ingest.throughput() / (1 << 20):.2f} MB/s.")
+    server_url = request.host_url.rstrip('/')
+    return jsonify({
+        "jobID": job_id,
+        "playlistURL": f"{server_url}/results/{job_id}/playlist.m3u8",
+        "ingest": video_jobs[job_id]["ingest"],
+    }), 202, {"Content-Type": "application/json"}
+
+@app.route("/results/<job_id>/<filename>", methods=["GET"])
+def get_result(job_id, filename):
+    job_dir = result_store.job_dir(job_id) if JOB_ID_PATTERN.match(job_id) else None
+    if job_dir is None:
+        return jsonify({"error": "Unknown or expired job."}), 404
+    if job_id in job_tokens:
+        job_last_seen[job_id] = time.time()
+    mimetype = "application/vnd.apple.mpegurl" if filename.endswith(".m3u8") else "video/mp4"
+    response = send_from_directory(job_dir, filename, mimetype=mimetype)
+    if filename.endswith(".m3u8"):
+        response.cache_control.no_cache = True  # the playlist grows while the job runs
+    return response
+
+@app.route("/results/stats", methods=["GET"])
+def result_stats():
+    return jsonify(result_store.stats())
+
+def is_admin(req):
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(req.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+    return req.remote_addr in ("127.0.0.1", "::1")
+
+@app.route("/admin/reload-model", methods=["POST"])
+def reload_model():
+    """Loads a checkpoint (JSON field `model`, default MODEL_PATH) and hot-swaps it in once it passes warmup."""
+    if not is_admin(request):
+        return jsonify({"error": "Forbidden."}), 403
+    model_path = (request.get_json(silent=True) or {}).get("model") or MODEL_PATH
+    if not os.path.isfile(model_path):
+        return jsonify({"error": f"Model file not found: {model_path}."}), 400
+    if not model_reloader.reload(model_path):
+        return jsonify({"error": "A model reload is already in progress.", **model_reloader.status()}), 409
+    return jsonify(model_reloader.status()), 202
+
+@app.route("/admin/reload-model", methods=["GET"])
+def reload_model_status():
+    if not is_admin(request):
+        return jsonify({"error": "Forbidden."}), 403
+    return jsonify(model_reloader.status())
+
+@app.route("/jobs/stats", methods=["GET"])
+def job_stats():
+    return jsonify({**cancellation_metrics.to_dict(), "static_frames": static_frame_metrics.to_dict()})
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = video_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job."}), 404
+    if job_id in job_tokens:
+        job_last_seen[job_id] = time.time()
+    return jsonify({"jobID": job_id, **job})
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    if job_id not in video_jobs:
+        return jsonify({"error": "Unknown job."}), 404
+    token = job_tokens.get(job_id)
+    if token is None:
+        return jsonify({"jobID": job_id, **video_jobs[job_id]}), 409
+    token.cancel("aborted")
+    return jsonify({"jobID": job_id, "status": "cancelling"}), 202
+
+@app.route("/queue", methods=["POST"])
+def enqueue_job():
+    """Queues a video (`file`) or an album (`images`, repeated) for the worker processes.
+
+    Album images whose luminance hashes differ in at most `dedupThreshold` bits share one model run.
+    """
+    dedup_threshold = request.form.get("dedupThreshold")
+    if dedup_threshold:
+        if not dedup_threshold.isdecimal() or int(dedup_threshold) > 64:
+            return jsonify({"error": "dedupThreshold must be a number of bits (0-64)."}), 400
+        dedup_threshold = int(dedup_threshold)
+    else:
+        dedup_threshold = None
+
+    job_id = uuid.uuid4().hex
+    upload_dir = os.path.abspath(QUEUE_UPLOADS_DIR)
+    os.makedirs(upload_dir, exist_ok=True)
+    output_dir = os.path.join(result_store.root, job_id)
+
+    if "file" in request.files:
+        input_path = os.path.join(upload_dir, f"{job_id}.mp4")
+        request.files["file"].save(input_path)
+        job_queue.enqueue("video", {"input": input_path, "output_dir": output_dir}, job_id=job_id)
+    elif request.files.getlist("images"):
+        input_paths = []
+        for i, image in enumerate(request.files.getlist("images")):
+            # Index prefix keeps outputs apart when names repeat; the extension is all that is kept
+            ext = os.path.splitext(image.filename or "")[1].lower() or ".png"
+            input_paths.append(os.path.join(upload_dir, f"{job_id}_{i:04d}{ext}"))
+            image.save(input_paths[-1])
+        payload = {"inputs": input_paths, "output_dir": output_dir, "dedup_threshold": dedup_threshold}
+        job_queue.enqueue("album", payload, job_id=job_id)
+    else:
+        return jsonify({"error": "Send a video as `file` or images as `images`."}), 400
+
+    server_url = request.host_url.rstrip('/')
+    return jsonify({"jobID": job_id, "statusURL": f"{server_url}/queue/{job_id}"}), 202
+
+@app.route("/queue/stats", methods=["GET"])
+def queue_stats():
+    return jsonify(job_queue.stats())
+
+@app.route("/queue/<job_id>", methods=["GET"])
+def get_queued_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job."}), 404
+    status = {key: job[key] for key in ("kind", "status", "attempts", "worker", "error")}
+    if job["status"] == "done":
+        server_url = request.host_url.rstrip('/')
+        result = dict(job["result"])
+        status["outputURLs"] = [f"{server_url}/results/{job_id}/{name}" for name in result.pop("outputs")]
+        status.update(result)
+    return jsonify({"jobID": job_id, **status})
+
+@app.route("/queue/<job_id>", methods=["DELETE"])
+def cancel_queued_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job."}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({"error": "Job already finished."}), 409
+    for input_path in job["payload"].get("inputs", [job["payload"].get("input")]):
+        if input_path and os.path.exists(input_path):
+            os.remove(input_path)
+    return jsonify({"jobID": job_id, "status": "cancelled"}), 202
 
 if __name__ == "__main__":
     # Parse command-line arguments
@@ -237,14 +747,62 @@ if __name__ == "__main__":
     parser.add_argument("--host", default=DEFAULT_HOST, help=f"Host address to bind (default: {DEFAULT_HOST})")
     parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to bind (default: {DEFAULT_PORT})")
     parser.add_argument("--model", default=MODEL_PATH, help=f"Path to the pretrained model (default: {MODEL_PATH})")
+    parser.add_argument("--backend", default=ENGINE_BACKEND, choices=list(BACKENDS),
+                        help="Model execution backend (default: %(default)s)")
+    parser.add_argument("--precision", default=ENGINE_PRECISION, choices=list(PRECISIONS),
+                        help="Inference precision (default: %(default)s)")
+    parser.add_argument("--channels-last", action="store_true", default=ENGINE_CHANNELS_LAST,
+                        help="Run the model in the channels-last memory format")
+    parser.add_argument("--max-upload-mb", type=int, default=MAX_UPLOAD_BYTES // (1024 * 1024),
+                        help="Size cap for streamed video uploads in MB (default: %(default)s)")
+    parser.add_argument("--result-ttl", type=int, default=RESULT_TTL_SECONDS,
+                        help="Seconds a video result is kept after its last fetch (default: %(default)s)")
+    parser.add_argument("--result-quota-mb", type=int, default=RESULT_QUOTA_BYTES // (1024 * 1024),
+                        help="Disk quota for stored video results in MB (default: %(default)s)")
+    parser.add_argument("--admin-token", default=os.environ.get("ADMIN_TOKEN"),
+                        help="Token for the /admin endpoints, sent as X-Admin-Token (default: $ADMIN_TOKEN; "
+                             "without one they only answer local requests)")
+    parser.add_argument("--queue", default=QUEUE_PATH,
+                        help="SQLite job queue shared with worker.py processes (default: %(default)s)")
+    parser.add_argument("--queue-no-wal", action="store_true",
+                        help="Disable WAL mode, for a queue on network storage shared across hosts")
+    parser.add_argument("--static-frame-threshold", type=float, default=STATIC_FRAME_THRESHOLD,
+                        help="Mean L difference (0-100) under which a video frame reuses the previous frame's "
+                             "colors; 0 disables (default: %(default)s)")
+    parser.add_argument("--tenant-max-concurrency", type=int, default=TENANT_MAX_CONCURRENCY,
+                        help="Image requests one client may have in the model at a time; video frames are only "
+                             "capped by the bulk lane's share of the executor (default: %(default)s)")
+    parser.add_argument("--tenant-weight", action="append", default=[], metavar="API_KEY=WEIGHT",
+                        help="Fair-share weight of an API key; may be repeated")
     
     args = parser.parse_args()
+    MAX_UPLOAD_BYTES = args.max_upload_mb * 1024 * 1024
+    ADMIN_TOKEN = args.admin_token
+    STATIC_FRAME_THRESHOLD = args.static_frame_threshold
+    if args.queue != QUEUE_PATH or args.queue_no_wal:
+        QUEUE_PATH = args.queue
+        job_queue = JobQueue(QUEUE_PATH, wal=not args.queue_no_wal)
+    result_store.ttl_seconds = args.result_ttl
+    result_store.quota_bytes = args.result_quota_mb * 1024 * 1024
+    scheduler.max_concurrency = args.tenant_max_concurrency
+    for entry in args.tenant_weight:
+        api_key, weight = entry.rsplit("=", 1)
+        scheduler.weights[tenant_id(api_key, None)] = float(weight)
     
-    # Update model path if provided
-    if args.model != MODEL_PATH:
+    # Update model path or engine options if provided
+    if (args.model != MODEL_PATH or args.backend != ENGINE_BACKEND or args.precision != ENGINE_PRECISION
+            or args.channels_last != ENGINE_CHANNELS_LAST):
         MODEL_PATH = args.model
-        print(f"Using model: {MODEL_PATH}")
-        colorizer = ImageColorizationPipeline(model_path=MODEL_PATH, input_size=512, model_size='large')
+        ENGINE_BACKEND = args.backend
+        ENGINE_PRECISION = args.precision
+        ENGINE_CHANNELS_LAST = args.channels_last
+        memory_format = "channels-last" if ENGINE_CHANNELS_LAST else "contiguous"
+        print(f"Using model: {MODEL_PATH} ({ENGINE_BACKEND} backend, {ENGINE_PRECISION}, {memory_format})")
+        swap_pipeline(build_pipeline(MODEL_PATH))
+
+    # SIGHUP reloads MODEL_PATH, e.g. after a new checkpoint was copied over it
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: model_reloader.reload(MODEL_PATH))
     
     print(f"Starting server on {args.host}:{args.port}")
     app.run(host=args.host, port=args.port, debug=False)
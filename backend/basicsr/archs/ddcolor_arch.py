@@ -1,7 +1,8 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
-from basicsr.archs.ddcolor_arch_utils.unet import Hook, CustomPixelShuffle_ICNR,  UnetBlockWide, NormType, custom_conv_layer
+from basicsr.archs.ddcolor_arch_utils.unet import CustomPixelShuffle_ICNR,  UnetBlockWide, NormType, custom_conv_layer
 from basicsr.archs.ddcolor_arch_utils.convnext import ConvNeXt
 from basicsr.archs.ddcolor_arch_utils.transformer_utils import SelfAttentionLayer, CrossAttentionLayer, FFNLayer, MLP
 from basicsr.archs.ddcolor_arch_utils.position_encoding import PositionEmbeddingSine
@@ -28,12 +29,9 @@ class DDColor(nn.Module):
         super().__init__()
 
         self.encoder = Encoder(encoder_name, ['norm0', 'norm1', 'norm2', 'norm3'], from_pretrain=encoder_from_pretrain)
-        self.encoder.eval()
-        test_input = torch.randn(1, num_input_channels, *input_size)
-        self.encoder(test_input)
 
         self.decoder = Decoder(
-            self.encoder.hooks,
+            self.encoder.feature_channels(),
             nf=nf,
             last_norm=last_norm,
             num_queries=num_queries,
@@ -42,11 +40,26 @@ class DDColor(nn.Module):
             decoder_name=decoder_name
         )
         self.refine_net = nn.Sequential(custom_conv_layer(num_queries + 3, num_output_channels, ks=1, use_activ=False, norm_type=NormType.Spectral))
+        # Inference only, once refine_net holds a plain conv (see model_freezing.fuse_color_refine)
+        self.fused_refine = False
     
         self.do_normalize = do_normalize
         self.register_buffer('mean', torch.Tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1))
         self.register_buffer('std', torch.Tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1))
 
+    def fused_refine_forward(self, color_embed, img_features, x):
+        """refine_net applied to the color decoder output without materializing its num_queries channels.
+
+        The 1x1 refine conv is linear, so its weights for the query channels are first
+        combined with the color embeddings into one (out_channels, C) projection per image.
+        """
+        conv = self.refine_net[0][0]
+        num_queries = color_embed.shape[1]
+        with torch.autocast(x.device.type, enabled=False):
+            projection = torch.einsum("oq,bqc->boc", conv.weight[:, :num_queries, 0, 0], color_embed.float())
+            out = torch.einsum("boc,bchw->bohw", projection, img_features.float())
+            return out + F.conv2d(x.float(), conv.weight[:, num_queries:], conv.bias)
+
     def normalize(self, img):
         return (img - self.mean) / self.std
 
@@ -57,10 +70,16 @@ class DDColor(nn.Module):
         if x.shape[1] == 3:
             x = self.normalize(x)
         
-        self.encoder(x)
-        out_feat = self.decoder()
-        coarse_input = torch.cat([out_feat, x], dim=1)
-        out = self.refine_net(coarse_input)
+        # Features are passed explicitly, so concurrent forwards never share them
+        features = self.encoder(x)
+        if self.fused_refine:
+            out = self.fused_refine_forward(*self.decoder(features, return_embeddings=True), x)
+        else:
+            out_feat = self.decoder(features)
+            coarse_input = torch.cat([out_feat, x], dim=1)
+            # The refine head produces the ab values themselves, so it stays in float32 under autocast
+            with torch.autocast(x.device.type, enabled=False):
+                out = self.refine_net(coarse_input.float())
 
         if self.do_normalize:
             out = self.denormalize(out)
@@ -70,7 +89,7 @@ class DDColor(nn.Module):
 class Decoder(nn.Module):
 
     def __init__(self,
-                 hooks,
+                 encoder_channels,
                  nf=512,
                  blur=True,
                  last_norm='Weight',
@@ -79,7 +98,7 @@ class Decoder(nn.Module):
                  dec_layers=9,
                  decoder_name='MultiScaleColorDecoder'):
         super().__init__()
-        self.hooks = hooks
+        self.encoder_channels = encoder_channels
         self.nf = nf
         self.blur = blur
         self.last_norm = getattr(NormType, last_norm)
@@ -99,47 +118,48 @@ class Decoder(nn.Module):
             )
         else:
             self.color_decoder = SingleColorDecoder(
-                in_channels=hooks[-1].feature.shape[1], 
+                in_channels=encoder_channels[-1], 
                 num_queries=num_queries,
             )
 
 
-    def forward(self):
-        encode_feat = self.hooks[-1].feature
-        out0 = self.layers[0](encode_feat)
-        out1 = self.layers[1](out0) 
-        out2 = self.layers[2](out1) 
+    def forward(self, features, return_embeddings=False):
+        """Decodes the encoder features, ordered from the highest resolution to the deepest."""
+        encode_feat = features[-1]
+        skips = features[-2::-1]
+        out0 = self.layers[0](encode_feat, skips[0])
+        out1 = self.layers[1](out0, skips[1])
+        out2 = self.layers[2](out1, skips[2])
         out3 = self.last_shuf(out2) 
 
         if self.decoder_name == 'MultiScaleColorDecoder':
-            out = self.color_decoder([out0, out1, out2], out3)
+            out = self.color_decoder([out0, out1, out2], out3, return_embeddings)
         else:
-            out = self.color_decoder(out3, encode_feat)
+            out = self.color_decoder(out3, encode_feat, return_embeddings)
            
         return out
 
     def make_layers(self):
         decoder_layers = []
 
-        e_in_c = self.hooks[-1].feature.shape[1]
+        e_in_c = self.encoder_channels[-1]
         in_c = e_in_c
 
         out_c = self.nf
-        setup_hooks = self.hooks[-2::-1]
-        for layer_index, hook in enumerate(setup_hooks):
-            feature_c = hook.feature.shape[1]
-            if layer_index == len(setup_hooks) - 1:
+        skip_channels = self.encoder_channels[-2::-1]
+        for layer_index, feature_c in enumerate(skip_channels):
+            if layer_index == len(skip_channels) - 1:
                 out_c = out_c // 2
             decoder_layers.append(
                 UnetBlockWide(
-                    in_c, feature_c, out_c, hook, blur=self.blur, self_attention=False, norm_type=NormType.Spectral))
+                    in_c, feature_c, out_c, blur=self.blur, self_attention=False, norm_type=NormType.Spectral))
             in_c = out_c
         return nn.Sequential(*decoder_layers)
 
 
 class Encoder(nn.Module):
 
-    def __init__(self, encoder_name, hook_names, from_pretrain, **kwargs):
+    def __init__(self, encoder_name, feature_names, from_pretrain, **kwargs):
         super().__init__()
  
         if encoder_name == 'convnext-t' or encoder_name == 'convnext':
@@ -154,18 +174,18 @@ class Encoder(nn.Module):
             raise NotImplementedError
 
         self.encoder_name = encoder_name
-        self.hook_names = hook_names
-        self.hooks = self.setup_hooks()
+        self.feature_names = feature_names
 
         if from_pretrain:
             self.load_pretrain_model()
 
-    def setup_hooks(self):
-        hooks = [Hook(self.arch._modules[name]) for name in self.hook_names]
-        return hooks
+    def feature_channels(self):
+        return [self.arch.get_submodule(name).weight.shape[0] for name in self.feature_names]
 
     def forward(self, x):
-        return self.arch(x)
+        """The outputs of the `feature_names` norm layers, as a list."""
+        features = self.arch.forward_pyramid(x)
+        return [features[name] for name in self.feature_names]
     
     def load_pretrain_model(self):
         if self.encoder_name == 'convnext-t' or self.encoder_name == 'convnext':
@@ -266,6 +286,11 @@ class MultiScaleColorDecoder(nn.Module):
         # level embedding
         self.num_feature_levels = num_scales
         self.level_embed = nn.Embedding(self.num_feature_levels, hidden_dim)
+        # Inference only, once input_proj biases include the level embeddings (see model_freezing.fold_level_embed)
+        self.level_embed_folded = False
+
+        # HWx1xC positional encodings by (H, W, device, dtype); they only depend on the feature shape
+        self.pos_cache = {}
 
         # input projections
         self.input_proj = nn.ModuleList()
@@ -281,25 +306,27 @@ class MultiScaleColorDecoder(nn.Module):
         # output FFNs
         self.color_embed = MLP(hidden_dim, hidden_dim, color_embed_dim, 3)
 
-    def forward(self, x, img_features):
+    def forward(self, x, img_features, return_embeddings=False):
         # x is a list of multi-scale feature
         assert len(x) == self.num_feature_levels
         src = []
         pos = []
 
         for i in range(self.num_feature_levels):
-            pos.append(self.pe_layer(x[i], None).flatten(2))
-            src.append(self.input_proj[i](x[i]).flatten(2) + self.level_embed.weight[i][None, :, None])
+            pos.append(self.position_encoding(x[i]))
+            src.append(self.input_proj[i](x[i]).flatten(2))
+            if not self.level_embed_folded:
+                src[-1] = src[-1] + self.level_embed.weight[i][None, :, None]
 
-            # flatten NxCxHxW to HWxNxC
-            pos[-1] = pos[-1].permute(2, 0, 1)
-            src[-1] = src[-1].permute(2, 0, 1)    
+            # flatten NxCxHxW to HWxNxC; contiguous, or reduced-precision attention projections
+            # fall back to a batched matmul with one weight copy per position
+            src[-1] = src[-1].permute(2, 0, 1).contiguous()
 
         _, bs, _ = src[0].shape
 
-        # QxNxC
-        query_embed = self.query_embed.weight.unsqueeze(1).repeat(1, bs, 1)
-        output = self.query_feat.weight.unsqueeze(1).repeat(1, bs, 1)
+        # QxNxC, broadcast over the batch
+        query_embed = self.query_embed.weight.unsqueeze(1).expand(-1, bs, -1)
+        output = self.query_feat.weight.unsqueeze(1).expand(-1, bs, -1)
 
         for i in range(self.num_layers):
             level_index = i % self.num_feature_levels
@@ -323,11 +350,22 @@ class MultiScaleColorDecoder(nn.Module):
         decoder_output = self.decoder_norm(output)
         decoder_output = decoder_output.transpose(0, 1)  # [N, bs, C]  -> [bs, N, C]
         color_embed = self.color_embed(decoder_output)
+        if return_embeddings:
+            return color_embed, img_features
         out = torch.einsum("bqc,bchw->bqhw", color_embed, img_features)
 
         return out
 
 
+    def position_encoding(self, feature):
+        """HWx1xC positional encoding of an NxCxHxW feature, broadcast over the batch by the attention layers."""
+        key = (feature.shape[-2], feature.shape[-1], feature.device, feature.dtype)
+        if key not in self.pos_cache:
+            pos = self.pe_layer(feature[:1], None).flatten(2)
+            self.pos_cache[key] = pos.permute(2, 0, 1).contiguous()
+        return self.pos_cache[key]
+
+
 class SingleColorDecoder(nn.Module):
 
     def __init__(
@@ -374,12 +412,14 @@ class SingleColorDecoder(nn.Module):
             self.input_proj = nn.Sequential()
 
 
-    def forward(self, img_features, encode_feat):
+    def forward(self, img_features, encode_feat, return_embeddings=False):
         pos = self.pe_layer(encode_feat)
         src = encode_feat
         mask = None
         hs, memory = self.transformer(self.input_proj(src), mask, self.query_embed.weight, pos)
         color_embed = hs[-1]
+        if return_embeddings:
+            return color_embed, img_features
         color_preds = torch.einsum('bqc,bchw->bqhw', color_embed, img_features)
         return color_preds
 
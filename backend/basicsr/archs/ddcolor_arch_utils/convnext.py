@@ -123,6 +123,15 @@ class ConvNeXt(nn.Module):
 
         return self.norm(x.mean([-2, -1])) # global average pooling, (N, C, H, W) -> (N, C)
 
+    def forward_pyramid(self, x):
+        """The normalized output of every stage, by norm layer name, e.g. {'norm0': ..., 'norm3': ...}."""
+        features = {}
+        for i in range(4):
+            x = self.downsample_layers[i](x)
+            x = self.stages[i](x)
+            features[f'norm{i}'] = getattr(self, f'norm{i}')(x)
+        return features
+
     def forward(self, x):
         x = self.forward_features(x)
         # x = self.head_cls(x)
@@ -148,8 +157,9 @@ class LayerNorm(nn.Module):
         if self.data_format == "channels_last":  # B H W C
             return F.layer_norm(x, self.normalized_shape, self.weight, self.bias, self.eps)
         elif self.data_format == "channels_first":  # B C H W
-            u = x.mean(1, keepdim=True)
-            s = (x - u).pow(2).mean(1, keepdim=True)
-            x = (x - u) / torch.sqrt(s + self.eps)
-            x = self.weight[:, None, None] * x + self.bias[:, None, None]
-            return x
+            # One fused kernel over the (N, H, W, C) view, instead of a temporary per mean/var/affine step.
+            # The result comes back with channels-last strides; NCHW inputs get NCHW output again, so
+            # the layout is only channels-last when the channels-last mode asks for it
+            out = F.layer_norm(x.permute(0, 2, 3, 1), self.normalized_shape, self.weight, self.bias, self.eps)
+            out = out.permute(0, 3, 1, 2)
+            return out.contiguous() if x.is_contiguous() else out
@@ -2,28 +2,11 @@ from enum import Enum
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
-import collections
 
 
 NormType = Enum('NormType', 'Batch BatchZero Weight Spectral')
 
 
-class Hook:
-    feature = None
-
-    def __init__(self, module):
-        self.hook = module.register_forward_hook(self.hook_fn)
-
-    def hook_fn(self, module, input, output):
-        if isinstance(output, torch.Tensor):
-            self.feature = output
-        elif isinstance(output, collections.OrderedDict):
-            self.feature = output['out']
-
-    def remove(self):
-        self.hook.remove()
-
-
 class SelfAttention(nn.Module):
     "Self attention layer for nd."
 
@@ -187,13 +170,11 @@ class UnetBlockWide(nn.Module):
                  up_in_c: int,
                  x_in_c: int,
                  n_out: int,
-                 hook,
                  blur: bool = False,
                  self_attention: bool = False,
                  norm_type=NormType.Spectral):
         super().__init__()
 
-        self.hook = hook
         up_out = n_out
         self.shuf = CustomPixelShuffle_ICNR(up_in_c, up_out, blur=blur, norm_type=norm_type, extra_bn=True)
         self.bn = batchnorm_2d(x_in_c)
@@ -201,8 +182,7 @@ class UnetBlockWide(nn.Module):
         self.conv = custom_conv_layer(ni, n_out, norm_type=norm_type, self_attention=self_attention, extra_bn=True)
         self.relu = nn.ReLU()
 
-    def forward(self, up_in):
-        s = self.hook.feature
+    def forward(self, up_in, s):
         up_out = self.shuf(up_in)
         cat_x = self.relu(torch.cat([up_out, self.bn(s)], dim=1))
         return self.conv(cat_x)
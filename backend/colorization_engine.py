@@ -0,0 +1,450 @@
+import argparse
+import contextlib
+import copy
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from basicsr.archs.ddcolor_arch import DDColor
+from model_freezing import freeze_model
+from tensor_color import bgr_to_lab, lab_to_bgr, lab_to_rgb
+
+# Use GPU if available
+DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def build_model(model_path, input_size, model_size, device, freeze=True):
+    """Builds DDColor and loads a checkpoint's weights into it, in eval mode on `device`.
+
+    With `freeze`, spectral norms and batch norms are folded into plain weights for inference.
+    """
+    encoder_name = 'convnext-t' if model_size == 'tiny' else 'convnext-l'
+    decoder_type = "MultiScaleColorDecoder"
+
+    if decoder_type == 'MultiScaleColorDecoder':
+        model = DDColor(
+            encoder_name=encoder_name,
+            decoder_name='MultiScaleColorDecoder',
+            input_size=[input_size, input_size],
+            num_output_channels=2,
+            last_norm='Spectral',
+            do_normalize=False,
+            num_queries=100,
+            num_scales=3,
+            dec_layers=9,
+        )
+    else:
+        model = DDColor(
+            encoder_name=encoder_name,
+            decoder_name='SingleColorDecoder',
+            input_size=[input_size, input_size],
+            num_output_channels=2,
+            last_norm='Spectral',
+            do_normalize=False,
+            num_queries=256,
+        )
+
+    # Loaded on the CPU first, so the GPU never holds the checkpoint and the model at once
+    checkpoint = torch.load(model_path, map_location=torch.device('cpu'))
+    if "quantized_layers" in checkpoint:
+        # Written by quantize_model.py: rebuild its int8 layers so their weights load into them
+        if device.type != "cpu":
+            raise ValueError(f"{model_path} is quantized and only runs on the CPU.")
+        quantize_linears(model, checkpoint["quantized_layers"])
+    model.load_state_dict(checkpoint['params'], strict=False)
+    model.eval()
+    if freeze:
+        freeze_model(model)
+    return model.to(device)
+
+
+def quantize_linears(model, module_names):
+    """Dynamic int8 quantization of the nn.Linear layers inside the named submodules, in place."""
+    for name in module_names:
+        quantized = torch.ao.quantization.quantize_dynamic(model.get_submodule(name), {nn.Linear}, dtype=torch.qint8)
+        model.set_submodule(name, quantized)
+    return model
+
+
+def eager_backend(model, pipeline):
+    return model
+
+
+def compile_backend(model, pipeline):
+    return torch.compile(model)
+
+
+def export_backend(model, pipeline):
+    """Traces the model into a frozen TorchScript graph, with the casts of the pipeline's precision."""
+    example = torch.zeros(1, 3, pipeline.input_size, pipeline.input_size, device=pipeline.device)
+    example = example.contiguous(memory_format=pipeline.memory_format)
+    with torch.no_grad(), pipeline.autocast():
+        return torch.jit.freeze(torch.jit.trace(model, example))
+
+
+def quantized_backend(model, pipeline):
+    """Dynamic int8 quantization of the Linear layers; CPU only."""
+    if pipeline.device.type != "cpu":
+        raise ValueError("The quantized backend only runs on the CPU.")
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+# Execution backends, selectable by name; each turns the eager model into the callable that serves
+BACKENDS = {
+    "eager": eager_backend,
+    "compile": compile_backend,
+    "export": export_backend,
+    "quantized": quantized_backend,
+}
+
+# Inference precisions: the autocast dtype of the encoder and color decoder, whose weights stay in float32
+PRECISIONS = {
+    "fp32": None,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+
+
+def check_precision(precision, device, backend):
+    """Raises ValueError if `precision` cannot run on `device` with `backend`."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; choose from {', '.join(PRECISIONS)}.")
+    if precision == "fp32":
+        return
+    if backend == "quantized":
+        raise ValueError("The quantized backend only runs in fp32.")
+    if device.type == "cpu" and precision == "fp16":
+        raise ValueError("fp16 needs a GPU; use bf16 on the CPU.")
+    if device.type == "cuda" and precision == "bf16" and not torch.cuda.is_bf16_supported():
+        raise ValueError("This GPU does not support bf16; use fp16.")
+
+
+class ImageColorizationPipeline:
+    """Pre-processing, model call and post-processing shared by the server, the CLI and the workers."""
+
+    def __init__(self, model_path, input_size=256, model_size='large', backend='eager', device=None, color_ops=None,
+                 precision='fp32', freeze=True, channels_last=False):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}; choose from {', '.join(BACKENDS)}.")
+        self.input_size = input_size
+        self.device = device or DEVICE
+        check_precision(precision, self.device, backend)
+        self.backend = backend
+        self.precision = precision
+        # Lab math in torch pays off next to the model on a GPU; on the CPU OpenCV's lookup tables are faster
+        self.color_ops = color_ops or ("torch" if self.device.type == "cuda" else "opencv")
+        self.base_model = build_model(model_path, input_size, model_size, self.device, freeze)
+        # Channels-last keeps every conv and ConvNeXt block in NHWC, so the blocks' permutes are free views
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.base_model.to(memory_format=self.memory_format)
+        self.model = BACKENDS[backend](self.base_model, self)
+
+    def with_backend(self, backend):
+        """A pipeline sharing this one's weights but running them with another backend."""
+        pipeline = copy.copy(self)
+        pipeline.backend = backend
+        pipeline.model = BACKENDS[backend](self.base_model, pipeline)
+        return pipeline
+
+    def with_precision(self, precision):
+        """A pipeline sharing this one's weights but running them at another precision."""
+        check_precision(precision, self.device, self.backend)
+        pipeline = copy.copy(self)
+        pipeline.precision = precision
+        pipeline.model = BACKENDS[self.backend](self.base_model, pipeline)
+        return pipeline
+
+    def autocast(self):
+        """Context that runs the model at the pipeline's precision."""
+        dtype = PRECISIONS[self.precision]
+        if dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(self.device.type, dtype=dtype, cache_enabled=False)
+
+    def run_model(self, tensor_gray_rgb):
+        """The model's float32 ab prediction for a (n, 3, input_size, input_size) tensor on the pipeline's device."""
+        with self.autocast():
+            return self.model(tensor_gray_rgb.contiguous(memory_format=self.memory_format)).float()
+
+    def process(self, img):
+        start_time = time.time()
+
+        output_imgs, _ = self.process_batch([img])
+
+        end_time = time.time()
+        print(f"Time taken for colorization: {end_time - start_time:.2f} seconds")
+
+        return output_imgs[0]
+
+    def process_l(self, l_channel):
+        """Colorizes a single-channel Lab L image (float32, range [0, 100])."""
+        start_time = time.time()
+
+        orig_l, model_input = self.preprocess_l(l_channel)
+        output_ab = self.infer(model_input[None])
+        output_img = self.postprocess(orig_l, output_ab)
+
+        end_time = time.time()
+        print(f"Time taken for colorization: {end_time - start_time:.2f} seconds")
+
+        return output_img
+
+    @torch.no_grad()
+    def process_batch(self, imgs, max_batch_size=8):
+        """Colorizes BGR uint8 images of any sizes, sharing model forward passes between them.
+
+        Every image keeps its own full-resolution L for recombination; with torch
+        color ops, images are bucketed by shape so each bucket is converted as one
+        tensor. Returns the outputs in input order and per-image timings in ms,
+        where batch-level work is split evenly across the images of the batch.
+        """
+        timings = [{"preprocess_ms": 0.0, "inference_ms": 0.0, "postprocess_ms": 0.0} for _ in imgs]
+        buckets = {}
+        for i, img in enumerate(imgs):
+            buckets.setdefault(img.shape, []).append(i)
+
+        def charge(stage, indices, seconds):
+            for i in indices:
+                timings[i][stage] += seconds * 1000 / len(indices)
+
+        # Pre-processing: full-resolution L and model input per image
+        orig_ls, model_inputs = [None] * len(imgs), [None] * len(imgs)
+        for indices in buckets.values():
+            start = time.time()
+            if self.color_ops == "torch":
+                bgr = torch.from_numpy(np.stack([imgs[i] for i in indices])).to(self.device)
+                orig_l, model_input = self.preprocess_tensor(bgr.permute(0, 3, 1, 2).float().div_(255.0))
+                for j, i in enumerate(indices):
+                    orig_ls[i], model_inputs[i] = orig_l[j:j + 1], model_input[j]
+                charge("preprocess_ms", indices, time.time() - start)
+            else:
+                for i in indices:
+                    start = time.time()
+                    orig_ls[i], model_inputs[i] = self.preprocess(imgs[i])
+                    charge("preprocess_ms", [i], time.time() - start)
+
+        # Inference: every model input has the same shape, so batches mix buckets
+        output_abs = [None] * len(imgs)
+        order = [i for indices in buckets.values() for i in indices]
+        for offset in range(0, len(order), max_batch_size):
+            chunk = order[offset:offset + max_batch_size]
+            start = time.time()
+            if self.color_ops == "torch":
+                output_ab = self.run_model(torch.stack([model_inputs[i] for i in chunk]))
+            else:
+                output_ab = self.infer(np.stack([model_inputs[i] for i in chunk]))
+            for j, i in enumerate(chunk):
+                output_abs[i] = output_ab[j:j + 1]
+            charge("inference_ms", chunk, time.time() - start)
+
+        # Post-processing: each ab prediction is recombined with its own L
+        output_imgs = [None] * len(imgs)
+        for indices in buckets.values():
+            start = time.time()
+            if self.color_ops == "torch":
+                outputs = self.postprocess_tensor(torch.cat([orig_ls[i] for i in indices]),
+                                                  torch.cat([output_abs[i] for i in indices]))
+                for j, i in enumerate(indices):
+                    output_imgs[i] = outputs[j]
+                charge("postprocess_ms", indices, time.time() - start)
+            else:
+                for i in indices:
+                    start = time.time()
+                    output_imgs[i] = self.postprocess(orig_ls[i], output_abs[i])
+                    charge("postprocess_ms", [i], time.time() - start)
+
+        for timing in timings:
+            timing.update({stage: round(ms, 2) for stage, ms in timing.items()})
+            timing["total_ms"] = round(sum(timing.values()), 2)
+        return output_imgs, timings
+
+    def predict_abs(self, imgs, max_batch_size=8):
+        """The (1, 2, input_size, input_size) ab predictions of BGR images, batched through the model."""
+        model_inputs = [self.preprocess(img)[1] for img in imgs]
+        output_abs = []
+        for offset in range(0, len(model_inputs), max_batch_size):
+            output_ab = self.infer(np.stack(model_inputs[offset:offset + max_batch_size]))
+            output_abs.extend(output_ab[j:j + 1] for j in range(len(output_ab)))
+        return output_abs
+
+    def preprocess_tensor(self, bgr):
+        """Full-resolution L (n, 1, h, w) and gray RGB model input (n, 3, input_size, input_size) of a BGR batch in [0, 1]."""
+        orig_l = bgr_to_lab(bgr)[:, :1]
+        resized = F.interpolate(bgr, size=(self.input_size, self.input_size), mode='bilinear', align_corners=False)
+        img_l = bgr_to_lab(resized)[:, :1]
+        return orig_l, lab_to_rgb(torch.cat((img_l, torch.zeros_like(img_l), torch.zeros_like(img_l)), dim=1))
+
+    def postprocess_tensor(self, orig_l, output_ab):
+        """Upsamples ab to the L resolution and returns the BGR uint8 images as (h, w, 3) arrays."""
+        output_ab = F.interpolate(output_ab.float(), size=orig_l.shape[-2:])
+        output_bgr = lab_to_bgr(torch.cat((orig_l, output_ab), dim=1))
+        output_imgs = output_bgr.mul_(255.0).round_().to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+        return list(output_imgs)
+
+    def apply_ab(self, img, output_ab):
+        """Colorizes a BGR image with an ab prediction, which may come from another, similar image."""
+        img = img.astype(np.float32) * (1 / 255.0)
+        return self.postprocess(cv2.cvtColor(img, cv2.COLOR_BGR2Lab)[:, :, :1], output_ab)
+
+    def preprocess(self, img):
+        """Returns the full-resolution L channel (h, w, 1) and the (3, input_size, input_size) model input of a BGR image."""
+        img = img.astype(np.float32) * (1 / 255.0)
+        orig_l = cv2.cvtColor(img, cv2.COLOR_BGR2Lab)[:, :, :1]  # (h, w, 1)
+
+        img_resized = cv2.resize(img, (self.input_size, self.input_size))
+        img_l = cv2.cvtColor(img_resized, cv2.COLOR_BGR2Lab)[:, :, :1]
+
+        return orig_l, self._model_input(img_l)
+
+    def preprocess_l(self, l_channel):
+        """`preprocess` for a single-channel Lab L image (float32, range [0, 100])."""
+        img_l = cv2.resize(l_channel, (self.input_size, self.input_size))[:, :, None]
+        return l_channel[:, :, None], self._model_input(img_l)
+
+    @torch.no_grad()
+    def infer(self, model_inputs):
+        """Runs the model on stacked (n, 3, input_size, input_size) inputs; returns the (n, 2, input_size, input_size) ab on the CPU."""
+        tensor_gray_rgb = torch.from_numpy(model_inputs).to(self.device)
+        return self.run_model(tensor_gray_rgb).cpu()
+
+    def postprocess(self, orig_l, output_ab):
+        """Upsamples a (1, 2, h, w) ab prediction and merges it with the full-resolution L into a BGR uint8 image."""
+        height, width = orig_l.shape[:2]
+        output_ab_resize = F.interpolate(output_ab, size=(height, width))[0].float().numpy().transpose(1, 2, 0)
+        output_lab = np.concatenate((orig_l, output_ab_resize), axis=-1)
+        output_bgr = cv2.cvtColor(output_lab, cv2.COLOR_LAB2BGR)
+
+        return (output_bgr * 255.0).round().astype(np.uint8)
+
+    def _model_input(self, img_l):
+        """Builds the gray RGB model input from a resized L channel."""
+        img_gray_lab = np.concatenate((img_l, np.zeros_like(img_l), np.zeros_like(img_l)), axis=-1)  # Ensure 3 channels
+        img_gray_rgb = cv2.cvtColor(img_gray_lab, cv2.COLOR_LAB2RGB)
+        return np.ascontiguousarray(img_gray_rgb.transpose((2, 0, 1)), dtype=np.float32)
+
+
+def benchmark(pipeline, model_inputs, runs=10, warmup=2):
+    """Mean seconds per `infer` call on `model_inputs`, after `warmup` untimed calls."""
+    for _ in range(warmup):
+        pipeline.infer(model_inputs)
+    if pipeline.device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(runs):
+        pipeline.infer(model_inputs)  # returns on the CPU, so every call is synchronized
+    return (time.time() - start) / runs
+
+
+def ab_error(reference, candidate, model_inputs):
+    """Max and mean absolute ab difference of `candidate` from `reference` on the same inputs."""
+    diff = (reference.infer(model_inputs).float() - candidate.infer(model_inputs).float()).abs()
+    return diff.max().item(), diff.mean().item()
+
+
+def color_ops_error(pipeline, imgs):
+    """Max and mean absolute uint8 difference between the torch and the OpenCV pre/post-processing paths."""
+    torch_pipeline, opencv_pipeline = copy.copy(pipeline), copy.copy(pipeline)
+    torch_pipeline.color_ops, opencv_pipeline.color_ops = "torch", "opencv"
+    diffs = []
+    for torch_img, opencv_img in zip(torch_pipeline.process_batch(imgs)[0], opencv_pipeline.process_batch(imgs)[0]):
+        diffs.append(np.abs(opencv_img.astype(np.int16) - torch_img.astype(np.int16)))
+    return max(diff.max() for diff in diffs), float(np.mean([diff.mean() for diff in diffs]))
+
+
+def sample_images(size, batch_size, image_paths=()):
+    """The given images, padded with synthetic gray gradients up to `batch_size`."""
+    imgs = [cv2.imread(path) for path in image_paths]
+    imgs = [img for img in imgs if img is not None][:batch_size]
+    while len(imgs) < batch_size:
+        ramp = np.linspace(0, 255, size, dtype=np.float32)
+        gradient = np.add.outer(ramp, ramp[::-1] * (len(imgs) % 3) / 2) % 256
+        imgs.append(np.repeat(gradient.astype(np.uint8)[:, :, None], 3, axis=2))
+    return imgs
+
+
+def sample_inputs(pipeline, batch_size, image_paths=()):
+    """Model inputs from the given images, padded with synthetic gray gradients up to `batch_size`."""
+    return np.stack([pipeline.preprocess(img)[1] for img in sample_images(pipeline.input_size, batch_size, image_paths)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and check the execution backends and precisions "
+                                                 "against eager float32 PyTorch")
+    parser.add_argument('--model_path', type=str, default='./pretrained_model.pt')
+    parser.add_argument('--input_size', type=int, default=512, help='input size for model')
+    parser.add_argument('--model_size', type=str, default='large', help='ddcolor model size')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--precisions', nargs='+', default=list(PRECISIONS), choices=list(PRECISIONS))
+    parser.add_argument('--ab_tolerance', type=float, default=None,
+                        help='fail (exit 1) if a precision\'s mean |dab| from fp32 exceeds this')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=10, help='timed runs per backend')
+    parser.add_argument('--images', nargs='*', default=[],
+                        help='validation images to benchmark and compare on (default: synthetic)')
+    args = parser.parse_args()
+
+    reference = ImageColorizationPipeline(args.model_path, args.input_size, args.model_size)
+    model_inputs = sample_inputs(reference, args.batch_size, args.images)
+    print(f"Device: {reference.device}, batch size: {args.batch_size}, input size: {args.input_size}")
+
+    imgs = sample_images(args.input_size, args.batch_size, args.images)
+    max_error, mean_error = color_ops_error(reference, imgs)
+    print(f"Torch vs OpenCV pre/post-processing: max |d| = {max_error}, mean |d| = {mean_error:.4f} (uint8 levels)")
+
+    eager_seconds = benchmark(reference, model_inputs, args.runs)
+    unfrozen = ImageColorizationPipeline(args.model_path, args.input_size, args.model_size, freeze=False)
+    max_error, mean_error = ab_error(unfrozen, reference, model_inputs)
+    unfrozen_seconds = benchmark(unfrozen, model_inputs, args.runs)
+    print(f"Frozen vs unfrozen model: {unfrozen_seconds / eager_seconds:.2f}x faster, "
+          f"max |dab| = {max_error:.4f}, mean |dab| = {mean_error:.4f}")
+    del unfrozen
+
+    channels_last = ImageColorizationPipeline(args.model_path, args.input_size, args.model_size, channels_last=True)
+    max_error, mean_error = ab_error(reference, channels_last, model_inputs)
+    channels_last_seconds = benchmark(channels_last, model_inputs, args.runs)
+    print(f"Channels-last vs contiguous: {eager_seconds / channels_last_seconds:.2f}x faster, "
+          f"max |dab| = {max_error:.4f}, mean |dab| = {mean_error:.4f}")
+    del channels_last
+
+    print(f"{'backend':<10} {'build s':>8} {'ms/img':>9} {'speedup':>8} {'max |dab|':>10} {'mean |dab|':>11}")
+    for backend in args.backends:
+        start = time.time()
+        try:
+            pipeline = reference.with_backend(backend)
+            pipeline.infer(model_inputs[:1])  # compiling backends do their work on the first call
+        except Exception as e:
+            print(f"{backend:<10} unavailable: {e}")
+            continue
+        build_seconds = time.time() - start
+        seconds = eager_seconds if backend == "eager" else benchmark(pipeline, model_inputs, args.runs)
+        max_error, mean_error = ab_error(reference, pipeline, model_inputs)
+        print(f"{backend:<10} {build_seconds:>8.2f} {seconds / args.batch_size * 1000:>9.1f} "
+              f"{eager_seconds / seconds:>7.2f}x {max_error:>10.4f} {mean_error:>11.4f}")
+
+    print(f"{'precision':<10} {'ms/img':>9} {'speedup':>8} {'max |dab|':>10} {'mean |dab|':>11}")
+    failed = []
+    for precision in args.precisions:
+        try:
+            pipeline = reference.with_precision(precision)
+            seconds = eager_seconds if precision == "fp32" else benchmark(pipeline, model_inputs, args.runs)
+        except Exception as e:
+            print(f"{precision:<10} unavailable: {e}")
+            continue
+        max_error, mean_error = ab_error(reference, pipeline, model_inputs)
+        verdict = ""
+        if args.ab_tolerance is not None and not mean_error <= args.ab_tolerance:  # NaN fails too
+            failed.append(precision)
+            verdict = " FAIL"
+        print(f"{precision:<10} {seconds / args.batch_size * 1000:>9.1f} {eager_seconds / seconds:>7.2f}x "
+              f"{max_error:>10.4f} {mean_error:>11.4f}{verdict}")
+    if failed:
+        print(f"Mean ab error above {args.ab_tolerance} for: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,12 @@ import cv2
 import numpy as np
 import os
 from tqdm import tqdm
-import torch
-from basicsr.archs.ddcolor_arch import DDColor
-import torch.nn.functional as F
-from skimage.metrics import structural_similarity as ssim
+from colorization_engine import BACKENDS, PRECISIONS, ImageColorizationPipeline
+from concurrent.futures import ThreadPoolExecutor
 import time
+from near_duplicates import cluster_hashes, luminance_phash
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
 
 def calculate_psnr(img1, img2):
     mse = np.mean((img1 - img2) ** 2)
@@ -17,93 +18,155 @@ def calculate_psnr(img1, img2):
     return 20 * np.log10(PIXEL_MAX / np.sqrt(mse))
 
 def calculate_ssim(img1, img2):
-    img1_gray = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-    img2_gray = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-    return ssim(img1_gray, img2_gray, data_range=img2_gray.max() - img2_gray.min())
-
-class ImageColorizationPipeline(object):
-
-    def __init__(self, model_path, input_size=256, model_size='large'):
-        
-        self.input_size = input_size
-        if torch.cuda.is_available():
-            self.device = torch.device('cuda')
+    """SSIM of the gray versions of two BGR images, defined as skimage's default.
+
+    That is a 7x7 uniform window with sample covariances, a data range of the
+    second image's max - min, and the mean taken away from the 3-pixel border.
+    """
+    x = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    y = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY).astype(np.float64)
+    data_range = y.max() - y.min()
+    C1, C2 = (0.01 * data_range) ** 2, (0.03 * data_range) ** 2
+    win_size = 7
+    cov_norm = win_size ** 2 / (win_size ** 2 - 1)
+
+    def blur(img):
+        return cv2.blur(img, (win_size, win_size))
+
+    mu_x, mu_y = blur(x), blur(y)
+    var_x = cov_norm * (blur(x * x) - mu_x * mu_x)
+    var_y = cov_norm * (blur(y * y) - mu_y * mu_y)
+    cov_xy = cov_norm * (blur(x * y) - mu_x * mu_y)
+    ssim_map = ((2 * mu_x * mu_y + C1) * (2 * cov_xy + C2)) / ((mu_x ** 2 + mu_y ** 2 + C1) * (var_x + var_y + C2))
+    pad = win_size // 2
+    return float(ssim_map[pad:-pad, pad:-pad].mean())
+
+def calculate_metrics(output_img, reference_img):
+    """PSNR and SSIM of a uint8 output against a uint8 reference, resized to the output's size if needed."""
+    if reference_img.shape[:2] != output_img.shape[:2]:
+        reference_img = cv2.resize(reference_img, (output_img.shape[1], output_img.shape[0]), interpolation=cv2.INTER_AREA)
+    output_float = (output_img / 255.0).astype(np.float32)
+    reference_float = (reference_img / 255.0).astype(np.float32)
+    return calculate_psnr(output_float, reference_float), calculate_ssim(output_float, reference_float)
+
+class QualityMetrics:
+    """Computes PSNR/SSIM in a background thread, off the colorization critical path."""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._results = []
+
+    def submit(self, name, output_img, reference_img):
+        self._results.append((name, self._executor.submit(calculate_metrics, output_img, reference_img)))
+
+    def report(self):
+        """Waits for all metrics, prints them and returns the mean PSNR and SSIM."""
+        psnrs, ssims = [], []
+        for name, future in sorted(self._results, key=lambda result: result[0]):
+            psnr_value, ssim_value = future.result()
+            print(f"{name}: PSNR {psnr_value:.3f}, SSIM {ssim_value:.3f}")
+            psnrs.append(psnr_value)
+            ssims.append(ssim_value)
+        self._executor.shutdown()
+        if len(psnrs) > 1:
+            print(f"Mean over {len(psnrs)} images: PSNR {np.mean(psnrs):.3f}, SSIM {np.mean(ssims):.3f}")
+        return (np.mean(psnrs), np.mean(ssims)) if psnrs else (None, None)
+
+def colorize_files(colorizer, paths, on_output, dedup_threshold=None, token=None, batch_size=8):
+    """Colorizes the image files at `paths`, `batch_size` per model forward, and returns a report.
+
+    `on_output(index, output)` is called for every image as soon as its batch is
+    done, with None for files that cannot be read, so only one batch of images
+    is held in memory at a time.
+
+    With `dedup_threshold` set, images whose luminance hashes differ in at most
+    that many bits form a cluster; the model runs once per cluster and its ab
+    prediction is upsampled against every member's own L channel. All images
+    are hashed first, decoding one at a time and keeping only the hashes.
+    """
+    start_time = time.time()
+    timings = []
+
+    if dedup_threshold is None:
+        clusters = [[i] for i in range(len(paths))]
+    else:
+        hashes = {}
+        for i, path in enumerate(tqdm(paths, desc="Hashing images")):
+            img = cv2.imread(path)
+            if img is None:
+                on_output(i, None)
+            else:
+                hashes[i] = luminance_phash(img)
+        indices = list(hashes)
+        members = {}  # representative index -> cluster members, the representative first
+        for i, rep_position in zip(indices, cluster_hashes(list(hashes.values()), dedup_threshold)):
+            members.setdefault(indices[rep_position], []).append(i)
+        clusters = list(members.values())
+
+    inference_runs = 0
+    for offset in tqdm(range(0, len(clusters), batch_size), desc="Colorizing batches"):
+        if token is not None:
+            token.check()
+        chunk = []  # (cluster, representative image)
+        for cluster in clusters[offset:offset + batch_size]:
+            img = cv2.imread(paths[cluster[0]])
+            if img is None:
+                for i in cluster:
+                    on_output(i, None)
+            else:
+                chunk.append((cluster, img))
+        if not chunk:
+            continue
+        inference_runs += len(chunk)
+
+        if dedup_threshold is None:
+            outputs, batch_timings = colorizer.process_batch([img for _, img in chunk], batch_size)
+            timings.extend(batch_timings)
+            for (cluster, _), output_img in zip(chunk, outputs):
+                on_output(cluster[0], output_img)
         else:
-            self.device = torch.device('cpu')
-
-        if model_size == 'tiny':
-            self.encoder_name = 'convnext-t'
-        else:
-            self.encoder_name = 'convnext-l'
-
-        self.decoder_type = "MultiScaleColorDecoder"
-
-        if self.decoder_type == 'MultiScaleColorDecoder':
-            self.model = DDColor(
-                encoder_name=self.encoder_name,
-                decoder_name='MultiScaleColorDecoder',
-                input_size=[self.input_size, self.input_size],
-                num_output_channels=2,
-                last_norm='Spectral',
-                do_normalize=False,
-                num_queries=100,
-                num_scales=3,
-                dec_layers=9,
-            ).to(self.device)
-        else:
-            self.model = DDColor(
-                encoder_name=self.encoder_name,
-                decoder_name='SingleColorDecoder',
-                input_size=[self.input_size, self.input_size],
-                num_output_channels=2,
-                last_norm='Spectral',
-                do_normalize=False,
-                num_queries=256,
-            ).to(self.device)
-
-        self.model.load_state_dict(
-            torch.load(model_path, map_location=torch.device('cpu'))['params'],
-            strict=False)
-        self.model.eval()
-
-    @torch.no_grad()
-    def process(self, img):
-        start_time = time.time()  # Start time
-
-        self.height, self.width = img.shape[:2]
-
-        img = (img / 255.0).astype(np.float32)
-        orig_l = cv2.cvtColor(img, cv2.COLOR_BGR2Lab)[:, :, :1]  # (h, w, 1)
-
-        img_resized = cv2.resize(img, (self.input_size, self.input_size))
-        img_l = cv2.cvtColor(img_resized, cv2.COLOR_BGR2Lab)[:, :, :1]
-        img_gray_lab = np.concatenate((img_l, np.zeros_like(img_l), np.zeros_like(img_l)), axis=-1)  # Ensure 3 channels
-        img_gray_rgb = cv2.cvtColor(img_gray_lab, cv2.COLOR_LAB2RGB)
-
-        tensor_gray_rgb = torch.from_numpy(img_gray_rgb.transpose((2, 0, 1))).float().unsqueeze(0).to(self.device)
-        output_ab = self.model(tensor_gray_rgb).cpu()  # (1, 2, self.height, self.width)
-
-        output_ab_resize = F.interpolate(output_ab, size=(self.height, self.width))[0].float().numpy().transpose(1, 2, 0)
-        output_lab = np.concatenate((orig_l, output_ab_resize), axis=-1)
-        output_bgr = cv2.cvtColor(output_lab, cv2.COLOR_LAB2BGR)
-
-        output_img = (output_bgr * 255.0).round().astype(np.uint8)
-
-        # Resize output_bgr to match the original image dimensions
-        output_bgr_resized = cv2.resize(output_bgr, (self.width, self.height))
-
-        # Calculate PSNR
-        psnr_value = calculate_psnr(img, output_bgr_resized)
-        print(f"PSNR: {psnr_value:.3f}")
-
-        # Calculate SSIM
-        ssim_value = calculate_ssim(img, output_bgr_resized)
-        print(f"SSIM: {ssim_value:.3f}")
-
-        end_time = time.time()  # End time
-        print(f"Time taken for colorization: {end_time - start_time:.2f} seconds")
-
-        return output_img
+            for (cluster, img), output_ab in zip(chunk, colorizer.predict_abs([img for _, img in chunk], batch_size)):
+                on_output(cluster[0], colorizer.apply_ab(img, output_ab))
+                for i in cluster[1:]:
+                    member = cv2.imread(paths[i])
+                    on_output(i, colorizer.apply_ab(member, output_ab) if member is not None else None)
+
+    report = {
+        "images": len(paths),
+        "inference_runs": inference_runs,
+        "inference_reduction": round(1 - inference_runs / len(paths), 3) if paths else 0.0,
+        "seconds": round(time.time() - start_time, 2),
+    }
+    if timings:
+        report["mean_ms"] = {stage: round(np.mean([timing[stage] for timing in timings]), 2) for stage in timings[0]}
+    return report
+
+
+def colorize_dir(colorizer, input_dir, output_dir, dedup_threshold=None, metrics=None, ground_truth_dir=None, batch_size=8):
+    filenames = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    os.makedirs(output_dir, exist_ok=True)
+
+    def write_output(index, output_img):
+        filename = filenames[index]
+        if output_img is None:
+            print(f"Error: Unable to read image file {filename}")
+            return
+        if metrics is not None:
+            reference = cv2.imread(os.path.join(ground_truth_dir or input_dir, filename))
+            if reference is None:
+                print(f"Error: No ground truth for {filename}")
+            else:
+                metrics.submit(filename, output_img, reference)
+        cv2.imwrite(os.path.join(output_dir, os.path.splitext(filename)[0] + '.png'), output_img)
+
+    report = colorize_files(colorizer, [os.path.join(input_dir, f) for f in filenames], write_output,
+                            dedup_threshold, batch_size=batch_size)
+
+    print(f"Colorized {report['images']} images with {report['inference_runs']} model runs "
+          f"({report['inference_reduction']:.1%} fewer) in {report['seconds']:.2f} seconds")
+    if "mean_ms" in report:
+        print("Mean per image: " + ", ".join(f"{stage} {ms:.1f}" for stage, ms in report["mean_ms"].items()))
+    print(f"Outputs saved to {output_dir}")
 
 
 def main():
@@ -111,11 +174,35 @@ def main():
     parser.add_argument('--model_path', type=str, default='pretrain/net_g_200000.pth')
     parser.add_argument('--input_file', type=str, help='input image file path')
     parser.add_argument('--output_file', type=str, default='result.png', help='output image file path')
+    parser.add_argument('--input_dir', type=str, help='colorize every image in this directory instead of --input_file')
+    parser.add_argument('--output_dir', type=str, default='colorized', help='output directory for --input_dir')
+    parser.add_argument('--batch_size', type=int, default=8, help='images per model forward with --input_dir')
+    parser.add_argument('--dedup_threshold', type=int, default=None,
+                        help='with --input_dir, reuse one model run for images whose luminance hashes '
+                             'differ in at most this many of 64 bits (e.g. 6)')
     parser.add_argument('--input_size', type=int, default=512, help='input size for model')
     parser.add_argument('--model_size', type=str, default='large', help='ddcolor model size')
+    parser.add_argument('--backend', type=str, default='eager', choices=list(BACKENDS), help='model execution backend')
+    parser.add_argument('--precision', type=str, default='fp32', choices=list(PRECISIONS), help='inference precision')
+    parser.add_argument('--channels_last', action='store_true', help='run the model in the channels-last memory format')
+    parser.add_argument('--metrics', action='store_true', help='report PSNR and SSIM of the outputs')
+    parser.add_argument('--ground_truth', type=str, default=None,
+                        help='color reference for --metrics: an image, or a directory of same-named images with '
+                             '--input_dir (default: the input itself)')
     args = parser.parse_args()
 
-    colorizer = ImageColorizationPipeline(model_path=args.model_path, input_size=args.input_size, model_size=args.model_size)
+    metrics = QualityMetrics() if args.metrics else None
+
+    colorizer = ImageColorizationPipeline(model_path=args.model_path, input_size=args.input_size, model_size=args.model_size,
+                                          backend=args.backend, precision=args.precision,
+                                          channels_last=args.channels_last)
+
+    if args.input_dir:
+        colorize_dir(colorizer, args.input_dir, args.output_dir, args.dedup_threshold, metrics, args.ground_truth,
+                     args.batch_size)
+        if metrics is not None:
+            metrics.report()
+        return
 
     img = cv2.imread(args.input_file)
     if img is None:
@@ -123,9 +210,20 @@ def main():
         return
 
     image_out = colorizer.process(img)
+
+    if metrics is not None:
+        reference = cv2.imread(args.ground_truth) if args.ground_truth else img
+        if reference is None:
+            print(f"Error: Unable to read ground truth file {args.ground_truth}")
+        else:
+            metrics.submit(os.path.basename(args.input_file), image_out, reference)
+
     cv2.imwrite(args.output_file, image_out)
     print(f"Output saved to {args.output_file}")
 
+    if metrics is not None:
+        metrics.report()
+
 
 if __name__ == '__main__':
     main()
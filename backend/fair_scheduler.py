@@ -0,0 +1,167 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+
+class Tenant:
+    """Queue, weight, concurrency cap and wait-time stats of one client."""
+
+    def __init__(self, tenant_id, weight, max_concurrency, window=1000):
+        self.id = tenant_id
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.queue = collections.deque()  # (tag, enqueued_at, img, encode, with_ab, future)
+        self.last_tag = 0.0
+        self.in_flight = 0
+        self.completed = 0
+        self.waits = collections.deque(maxlen=window)
+
+    def to_dict(self):
+        waits = sorted(self.waits)
+        return {
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "queued": len(self.queue),
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "p95_wait_ms": round(waits[int(0.95 * (len(waits) - 1))] * 1000, 1) if waits else 0.0,
+            "p99_wait_ms": round(waits[int(0.99 * (len(waits) - 1))] * 1000, 1) if waits else 0.0,
+            "max_wait_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
+
+
+class Lane:
+    """Tenants and virtual clock of one priority class."""
+
+    def __init__(self):
+        self.tenants = {}
+        self.virtual_time = 0.0
+
+    def next_tenant(self):
+        # Smallest virtual finish tag among tenants that may run another request
+        best = None
+        for tenant in self.tenants.values():
+            if tenant.queue and tenant.in_flight < tenant.max_concurrency:
+                if best is None or tenant.queue[0][0] < best.queue[0][0]:
+                    best = tenant
+        return best
+
+    def drop_if_idle(self, tenant):
+        """Forgets a tenant with nothing queued or in flight, so clients that went away are not kept forever."""
+        if not tenant.queue and tenant.in_flight == 0 and self.tenants.get(tenant.id) is tenant:
+            del self.tenants[tenant.id]
+
+
+class FairScheduler:
+    """Weighted fair queuing of colorization requests across clients.
+
+    Every client (tenant) has its own queue. Each request gets a virtual finish
+    tag that advances by 1 / weight per request of that tenant, and the request
+    with the smallest tag among tenants below their concurrency cap goes next.
+    Only `max_outstanding` requests are handed to the executor at a time, so the
+    backlog waits here, where the order is fair, rather than in the executor's FIFO
+    queues.
+
+    Requests come in two priority lanes. "interactive" requests always go
+    before "bulk" ones (video frames), except that one bulk request is let
+    through after every `bulk_every` interactive dispatches, so bulk work keeps
+    moving under sustained interactive load. Bulk requests never take more than
+    `max_bulk_outstanding` executor slots, so an interactive request waits for
+    at most one model batch. `max_concurrency` caps each tenant in the
+    interactive lane; in the bulk lane the cap is `max_bulk_concurrency`, by
+    default `max_bulk_outstanding`, so one video can fill a model batch.
+
+    A tenant is dropped once it has nothing queued or in flight, so stats only
+    cover active clients; one that comes back starts at the lane's virtual time.
+    """
+
+    LANES = ("interactive", "bulk")
+
+    def __init__(self, executor, weights=None, default_weight=1.0, max_concurrency=2, max_outstanding=4,
+                 max_bulk_outstanding=None, bulk_every=8, max_bulk_concurrency=None):
+        self.executor = executor
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.max_concurrency = max_concurrency
+        self.max_outstanding = max_outstanding
+        self.max_bulk_outstanding = max_bulk_outstanding or max(1, max_outstanding // 2)
+        self.bulk_every = bulk_every
+        self.max_bulk_concurrency = max_bulk_concurrency or self.max_bulk_outstanding
+        self._lanes = {name: Lane() for name in self.LANES}
+        self._interactive_streak = 0
+        self._outstanding = 0
+        self._bulk_outstanding = 0
+        self._cond = threading.Condition()
+        threading.Thread(target=self._dispatch_loop, daemon=True).start()
+
+    def submit(self, tenant_id, img, encode=None, priority="interactive", with_ab=False):
+        """Queues an image for `tenant_id` and returns a Future like `PipelinedExecutor.submit`."""
+        future = Future()
+        with self._cond:
+            lane = self._lanes[priority]
+            tenant = lane.tenants.get(tenant_id)
+            if tenant is None:
+                max_concurrency = self.max_bulk_concurrency if priority == "bulk" else self.max_concurrency
+                tenant = Tenant(tenant_id, self.weights.get(tenant_id, self.default_weight), max_concurrency)
+                lane.tenants[tenant_id] = tenant
+            tag = max(lane.virtual_time, tenant.last_tag) + 1.0 / tenant.weight
+            tenant.last_tag = tag
+            tenant.queue.append((tag, time.time(), img, encode, with_ab, future))
+            self._cond.notify()
+        return future
+
+    def stats(self):
+        with self._cond:
+            return {name: {tenant_id: tenant.to_dict() for tenant_id, tenant in lane.tenants.items()}
+                    for name, lane in self._lanes.items()}
+
+    def _next_request(self):
+        interactive = self._lanes["interactive"].next_tenant()
+        bulk = self._lanes["bulk"].next_tenant() if self._bulk_outstanding < self.max_bulk_outstanding else None
+        if interactive is not None and (bulk is None or self._interactive_streak < self.bulk_every):
+            return self._lanes["interactive"], interactive
+        if bulk is not None:
+            return self._lanes["bulk"], bulk
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while self._outstanding >= self.max_outstanding or self._next_request() is None:
+                    self._cond.wait()
+                lane, tenant = self._next_request()
+                tag, enqueued_at, img, encode, with_ab, future = tenant.queue.popleft()
+                lane.virtual_time = tag
+                if not future.set_running_or_notify_cancel():
+                    lane.drop_if_idle(tenant)
+                    continue  # cancelled while queued, e.g. frames of an aborted video job
+                bulk = lane is self._lanes["bulk"]
+                if bulk:
+                    self._interactive_streak = 0
+                    self._bulk_outstanding += 1
+                else:
+                    self._interactive_streak += 1
+                tenant.in_flight += 1
+                tenant.waits.append(time.time() - enqueued_at)
+                self._outstanding += 1
+
+            inner = self.executor.submit(img, encode=encode, with_ab=with_ab)
+            inner.add_done_callback(
+                lambda inner, lane=lane, tenant=tenant, future=future: self._finish(lane, tenant, inner, future))
+
+    def _finish(self, lane, tenant, inner, future):
+        with self._cond:
+            tenant.in_flight -= 1
+            tenant.completed += 1
+            self._outstanding -= 1
+            if lane is self._lanes["bulk"]:
+                self._bulk_outstanding -= 1
+            lane.drop_if_idle(tenant)
+            self._cond.notify()
+
+        if inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
@@ -0,0 +1,74 @@
+import socket
+import threading
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """Cooperative cancellation flag, checked by the frame loops between frames or batches.
+
+    `probe` is an optional callable polled on every check; when it returns True
+    the job is cancelled, e.g. because the client went away.
+    """
+
+    def __init__(self, probe=None):
+        self.probe = probe
+        self.reason = None
+        self.frames_discarded = 0  # queued frames dropped because of the cancellation
+        self._event = threading.Event()
+
+    def cancel(self, reason="aborted"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self.probe is not None and self.probe():
+            self.cancel("client disconnected")
+        return self._event.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(self.reason)
+
+
+def client_disconnected(sock):
+    """Whether the peer of a request socket has closed its end of the connection."""
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
+
+
+class CancellationMetrics:
+    """Counts of cancelled jobs and of the frames they no longer needed."""
+
+    def __init__(self):
+        self.jobs = 0
+        self.by_reason = {}
+        self.frames_done = 0
+        self.frames_discarded = 0
+        self._lock = threading.Lock()
+
+    def record(self, reason, frames_done=0, frames_discarded=0):
+        with self._lock:
+            self.jobs += 1
+            self.by_reason[reason] = self.by_reason.get(reason, 0) + 1
+            self.frames_done += frames_done
+            self.frames_discarded += frames_discarded
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "cancelled_jobs": self.jobs,
+                "by_reason": dict(self.by_reason),
+                "frames_done_before_cancel": self.frames_done,
+                "frames_discarded": self.frames_discarded,
+            }
@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobQueue:
+    """Durable job queue in a SQLite file, shared by HTTP front-ends and workers.
+
+    A job goes queued -> leased -> done, failed or cancelled, and a done job
+    becomes expired once its results are deleted. A worker leases the
+    oldest queued job for `lease_seconds` and must heartbeat before the lease runs
+    out. Leases of dead workers expire and their jobs are queued again, until a job
+    has been attempted `max_attempts` times. Workers on other hosts can share the
+    file as long as the storage supports SQLite's file locking; pass `wal=False`
+    there, since WAL mode needs all processes on one host.
+    """
+
+    STATUSES = ("queued", "leased", "done", "failed", "cancelled", "expired")
+
+    def __init__(self, path, lease_seconds=60, max_attempts=3, wal=True):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with closing(self._connect()) as conn:
+            conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+            conn.executescript(SCHEMA)
+
+    def enqueue(self, kind, payload, job_id=None):
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now))
+        return job_id
+
+    def lease(self, worker_id):
+        """Leases the oldest queued job to `worker_id`; returns it as a dict, or None if there is none."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            self._reap(conn, now)
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, attempts = attempts + 1, lease_expires = ?, "
+                "updated_at = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        job = self._to_dict(row)
+        job.update({"status": "leased", "worker": worker_id, "attempts": row["attempts"] + 1})
+        return job
+
+    def heartbeat(self, job_id, worker_id):
+        """Extends a lease; False if the worker no longer holds it (expired, reassigned or cancelled)."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (now + self.lease_seconds, now, job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result=None):
+        return self._finish(job_id, worker_id, "done", result=json.dumps(result))
+
+    def fail(self, job_id, worker_id, error, retry=True):
+        """Records a failed attempt and returns the job's new status, or None if the worker no longer held it.
+
+        The job is queued again unless it has used up its attempts or `retry` is False.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        status = "queued" if retry and row is not None and row["attempts"] < self.max_attempts else "failed"
+        return status if self._finish(job_id, worker_id, status, error=str(error)) else None
+
+    def cancel(self, job_id):
+        """Cancels a queued or leased job; its worker notices on its next heartbeat."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'leased')",
+                (now, job_id))
+        return cursor.rowcount == 1
+
+    def expire(self, job_id):
+        """Marks a done job whose results were deleted; False if it is not a done job."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'expired', updated_at = ? WHERE id = ? AND status = 'done'",
+                (now, job_id))
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            workers = conn.execute(
+                "SELECT COUNT(DISTINCT worker) FROM jobs WHERE status = 'leased' AND lease_expires > ?",
+                (time.time(),)).fetchone()[0]
+        return {"jobs": {status: counts.get(status, 0) for status in self.STATUSES}, "active_workers": workers}
+
+    def _finish(self, job_id, worker_id, status, result=None, error=None):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, worker = NULL, lease_expires = NULL, "
+                "updated_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (status, result, error, now, job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def _reap(self, conn, now):
+        # Jobs of workers that stopped heartbeating go back to the queue, or fail once out of attempts
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+            "error = 'worker lease expired', worker = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, now))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
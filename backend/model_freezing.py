@@ -0,0 +1,108 @@
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+def remove_spectral_norms(model):
+    """Replaces every spectral-normalized weight by its normalized value, dropping the per-forward sigma."""
+    for module in model.modules():
+        if hasattr(module, "weight_orig"):
+            nn.utils.remove_spectral_norm(module)
+
+
+def fold_conv_batchnorms(model):
+    """Folds every BatchNorm2d that directly follows a Conv2d in an nn.Sequential into that conv."""
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module) - 1):
+            if isinstance(module[i], nn.Conv2d) and isinstance(module[i + 1], nn.BatchNorm2d):
+                module[i] = fuse_conv_bn_eval(module[i], module[i + 1])
+                module[i + 1] = nn.Identity()
+
+
+def batchnorm_affine(bn):
+    """Per-channel (scale, shift) of an eval-mode BatchNorm2d."""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    return scale, bn.bias - bn.running_mean * scale
+
+
+def fold_into_next_conv(scale, shift, conv):
+    """Folds a per-channel affine applied to the input of a 1x1 conv into the conv's weight and bias."""
+    weight = conv.weight[:, :, 0, 0]
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(weight[:, 0])
+    conv.bias = nn.Parameter(bias + weight @ shift)
+    conv.weight = nn.Parameter(conv.weight * scale[None, :, None, None])
+
+
+def is_pointwise(conv):
+    return (isinstance(conv, nn.Conv2d) and conv.kernel_size == (1, 1) and conv.padding == (0, 0)
+            and conv.groups == 1)
+
+
+def fold_decoder_batchnorms(model):
+    """Folds the BatchNorms of DDColor's UNet decoder blocks that sit after a ReLU or on a skip connection.
+
+    The skip BatchNorm of a block goes into the affine of the encoder LayerNorm whose
+    output it normalizes. The BatchNorm after a block's conv and ReLU goes into the
+    1x1 convs that consume the block's output: the next block's upsampling conv and,
+    with the multi-scale color decoder, that scale's input projection.
+    """
+    decoder, encoder = model.decoder, model.encoder
+    blocks = list(decoder.layers)
+    for i, block in enumerate(blocks):
+        # Block i takes the skip feature of the i-th deepest norm layer after the last one
+        norm = encoder.arch.get_submodule(encoder.feature_names[-2 - i])
+        if isinstance(block.bn, nn.BatchNorm2d):
+            scale, shift = batchnorm_affine(block.bn)
+            norm.weight = nn.Parameter(norm.weight * scale)
+            norm.bias = nn.Parameter(norm.bias * scale + shift)
+            block.bn = nn.Identity()
+
+        bn = block.conv[-1]
+        next_shuf = blocks[i + 1].shuf if i + 1 < len(blocks) else decoder.last_shuf
+        consumers = [next_shuf.conv[0]]
+        if decoder.decoder_name == 'MultiScaleColorDecoder':
+            consumers.append(decoder.color_decoder.input_proj[i])
+        if isinstance(bn, nn.BatchNorm2d) and all(is_pointwise(conv) for conv in consumers):
+            scale, shift = batchnorm_affine(bn)
+            for conv in consumers:
+                fold_into_next_conv(scale, shift, conv)
+            block.conv[-1] = nn.Identity()
+
+
+def fold_level_embed(model):
+    """Adds the multi-scale color decoder's level embeddings to the biases of its input projections."""
+    color_decoder = model.decoder.color_decoder
+    if (not hasattr(color_decoder, "level_embed") or color_decoder.level_embed_folded
+            or not all(is_pointwise(conv) for conv in color_decoder.input_proj)):
+        return
+    for i, conv in enumerate(color_decoder.input_proj):
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(conv.weight[:, 0, 0, 0])
+        conv.bias = nn.Parameter(bias + color_decoder.level_embed.weight[i])
+    color_decoder.level_embed_folded = True
+
+
+def fuse_color_refine(model):
+    """Switches DDColor to applying its 1x1 refine conv straight to the color embeddings and image features."""
+    conv = model.refine_net[0][0]
+    if is_pointwise(conv) and not hasattr(conv, "weight_orig"):
+        model.fused_refine = True
+
+
+@torch.no_grad()
+def freeze_model(model):
+    """Prepares an eval-mode DDColor for inference, in place.
+
+    Normalization layers and level embeddings are folded into plain conv and norm
+    weights, and the color queries are fused with the refine head.
+
+    Outputs are unchanged up to float rounding; the model can no longer be trained or
+    saved in the checkpoint format.
+    """
+    remove_spectral_norms(model)
+    fold_conv_batchnorms(model)
+    fold_decoder_batchnorms(model)
+    fold_level_embed(model)
+    fuse_color_refine(model)
+    return model
@@ -0,0 +1,110 @@
+import gc
+import threading
+import time
+import weakref
+
+import numpy as np
+import torch
+
+
+class ModelReloader:
+    """Loads a new checkpoint in the background and swaps it in once it checks out.
+
+    `build(model_path)` constructs a pipeline and `swap(pipeline)` installs it as
+    the serving one, returning the pipeline it replaced. Before the swap, the new
+    pipeline runs `warmup_runs` forward passes on a synthetic gray ramp and its ab
+    output must have the expected shape, be finite and stay within the Lab ab range. Requests already in the model keep
+    the old pipeline; its memory is released once the last of them lets go of it.
+    """
+
+    def __init__(self, build, swap, warmup_runs=2, release_timeout=300):
+        self.build = build
+        self.swap = swap
+        self.warmup_runs = warmup_runs
+        self.release_timeout = release_timeout
+        self.state = "idle"  # idle, loading, warming_up, swapped or failed
+        self.model_path = None
+        self.error = None
+        self.timings = {}
+        self.swaps = 0
+        self._lock = threading.Lock()
+
+    def reload(self, model_path):
+        """Starts reloading from `model_path` in a background thread; False if a reload is already running."""
+        with self._lock:
+            if self.state in ("loading", "warming_up"):
+                return False
+            self.state = "loading"
+            self.model_path = model_path
+            self.error = None
+            self.timings = {}
+        threading.Thread(target=self._run, args=(model_path,), daemon=True).start()
+        return True
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "model_path": self.model_path,
+                "error": self.error,
+                "timings": dict(self.timings),
+                "swaps": self.swaps,
+            }
+
+    def _run(self, model_path):
+        try:
+            start = time.time()
+            pipeline = self.build(model_path)
+            self._set("warming_up", load_seconds=time.time() - start)
+
+            start = time.time()
+            self.check(pipeline)
+            self._set("warming_up", warmup_seconds=time.time() - start)
+        except Exception as e:
+            print(f"Error: model reload from {model_path} failed: {e}")
+            with self._lock:
+                self.state = "failed"
+                self.error = str(e)
+            return
+
+        old = self.swap(pipeline)
+        with self._lock:
+            self.state = "swapped"
+            self.swaps += 1
+        print(f"Serving model from {model_path}.")
+
+        old_model = weakref.ref(old.model) if old is not None else None
+        del old, pipeline
+        self._release(old_model)
+
+    def check(self, pipeline):
+        """Warms the pipeline up and raises ValueError if its output is not a sane ab prediction."""
+        size = pipeline.input_size
+        ramp = np.tile(np.linspace(0, 255, size, dtype=np.float32), (size, 1)).astype(np.uint8)
+        _, model_input = pipeline.preprocess(np.repeat(ramp[:, :, None], 3, axis=2))
+        for _ in range(max(1, self.warmup_runs)):
+            output_ab = pipeline.infer(model_input[None])
+
+        if tuple(output_ab.shape) != (1, 2, size, size):
+            raise ValueError(f"Unexpected output shape {tuple(output_ab.shape)}.")
+        if not torch.isfinite(output_ab).all():
+            raise ValueError("Model output contains NaN or infinite values.")
+        if output_ab.abs().max() > 128:
+            raise ValueError(f"Model output is outside the ab range: max |ab| = {output_ab.abs().max():.1f}.")
+
+    def _set(self, state, **timings):
+        with self._lock:
+            self.state = state
+            self.timings.update({name: round(seconds, 3) for name, seconds in timings.items()})
+
+    def _release(self, old_model):
+        # In-flight batches hold the old pipeline until they finish
+        deadline = time.time() + self.release_timeout
+        while old_model is not None and old_model() is not None and time.time() < deadline:
+            gc.collect()
+            time.sleep(0.5)
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        if old_model is not None and old_model() is not None:
+            print("Warning: the previous model is still referenced; its memory was not released.")
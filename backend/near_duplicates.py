@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+
+
+def luminance_phash(img, hash_size=8):
+    """64-bit perceptual hash of the Lab L channel of a BGR image.
+
+    The L channel is shrunk to 4 * hash_size pixels square, and each bit of the
+    hash says whether one of the lowest-frequency DCT coefficients is above
+    their median. Exposure and small shifts barely move it; content changes do.
+    """
+    small = cv2.resize(img, (4 * hash_size, 4 * hash_size), interpolation=cv2.INTER_AREA)
+    l_channel = cv2.cvtColor((small / 255.0).astype(np.float32), cv2.COLOR_BGR2Lab)[:, :, 0]
+    low_freq = cv2.dct(l_channel)[:hash_size, :hash_size].flatten()
+    bits = low_freq > np.median(low_freq[1:])  # the DC term would skew the median
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def cluster_near_duplicates(imgs, threshold):
+    """Groups images whose hashes differ in at most `threshold` bits.
+
+    Returns, for every image, the index of its cluster's representative: the
+    first image of the cluster, which is the one the model runs on.
+    """
+    return cluster_hashes([luminance_phash(img) for img in imgs], threshold)
+
+
+def cluster_hashes(hashes, threshold):
+    """cluster_near_duplicates on precomputed hashes, so the images need not be held in memory."""
+    representatives = []  # (index, hash)
+    clusters = []
+    for i, image_hash in enumerate(hashes):
+        for rep_index, rep_hash in representatives:
+            if hamming_distance(image_hash, rep_hash) <= threshold:
+                clusters.append(rep_index)
+                break
+        else:
+            representatives.append((i, image_hash))
+            clusters.append(i)
+    return clusters
@@ -0,0 +1,158 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+
+class StageStats:
+    """Busy time and item count of one executor stage."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    def to_dict(self, elapsed):
+        capacity = elapsed * self.workers
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "busy_seconds": round(self.busy, 3),
+            "utilization": round(self.busy / capacity, 3) if capacity > 0 else 0.0,
+        }
+
+
+class PipelinedExecutor:
+    """Colorizes images in three stages connected by bounded queues.
+
+    Pre-processing (BGR->Lab, resize, gray RGB), model inference and
+    post-processing (ab upsample, Lab->BGR, optional encoding) each have their
+    own workers, so image N+1 is prepared while image N is in the model. The
+    single inference worker batches whatever is waiting, up to `max_batch_size`.
+    Raw L inputs skip the BGR->Lab conversion.
+    """
+
+    def __init__(self, pipeline, pre_workers=2, post_workers=2, max_batch_size=4, queue_size=8):
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self._pre_queue = queue.Queue(maxsize=queue_size)
+        self._infer_queue = queue.Queue(maxsize=queue_size)
+        self._post_queue = queue.Queue(maxsize=queue_size)
+
+        self._stats = {
+            "preprocess": StageStats(pre_workers),
+            "inference": StageStats(1),
+            "postprocess": StageStats(post_workers),
+        }
+        self._started_at = time.time()
+        self._batches = 0
+        self._starved = 0.0  # seconds the model waited while images were still in pre-processing
+        self._in_preprocess = 0
+        self._lock = threading.Lock()
+
+        for _ in range(pre_workers):
+            threading.Thread(target=self._preprocess_loop, daemon=True).start()
+        threading.Thread(target=self._inference_loop, daemon=True).start()
+        for _ in range(post_workers):
+            threading.Thread(target=self._postprocess_loop, daemon=True).start()
+
+    def submit(self, img, encode=None, with_ab=False):
+        """Queues a BGR image, or a (h, w) float32 Lab L image, and returns a Future for the colorized image.
+
+        With `encode` set to an extension such as ".png", the future resolves
+        to the encoded bytes instead. With `with_ab`, it resolves to the output
+        and the model's (1, 2, input_size, input_size) ab prediction, which
+        `apply_ab` can reuse on similar images. Blocks while the pre-processing
+        queue is full.
+        """
+        future = Future()
+        self._pre_queue.put((img, encode, with_ab, future))
+        return future
+
+    def stats(self):
+        elapsed = time.time() - self._started_at
+        stats = {name: stage.to_dict(elapsed) for name, stage in self._stats.items()}
+        stats["inference"]["batches"] = self._batches
+        stats["inference"]["starved_seconds"] = round(self._starved, 3)
+        stats["queue_depth"] = {
+            "preprocess": self._pre_queue.qsize(),
+            "inference": self._infer_queue.qsize(),
+            "postprocess": self._post_queue.qsize(),
+        }
+        return stats
+
+    def _preprocess_loop(self):
+        while True:
+            img, encode, with_ab, future = self._pre_queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._in_preprocess += 1
+            start = time.time()
+            try:
+                if img.ndim == 2:
+                    orig_l, model_input = self.pipeline.preprocess_l(img)
+                else:
+                    orig_l, model_input = self.pipeline.preprocess(img)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            finally:
+                self._stats["preprocess"].record(1, time.time() - start)
+                with self._lock:
+                    self._in_preprocess -= 1
+            self._infer_queue.put((orig_l, model_input, encode, with_ab, future))
+
+    def _inference_loop(self):
+        while True:
+            # Waiting while images are still being prepared means pre-processing is the bottleneck
+            upstream_busy = self._in_preprocess > 0 or not self._pre_queue.empty()
+            wait_start = time.time()
+            batch = [self._infer_queue.get()]
+            if upstream_busy:
+                self._starved += time.time() - wait_start
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._infer_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            start = time.time()
+            try:
+                output_ab = self.pipeline.infer(np.stack([model_input for _, model_input, _, _, _ in batch]))
+            except Exception as e:
+                for _, _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                self._stats["inference"].record(len(batch), time.time() - start)
+            self._batches += 1
+
+            for i, (orig_l, _, encode, with_ab, future) in enumerate(batch):
+                self._post_queue.put((orig_l, output_ab[i:i + 1], encode, with_ab, future))
+
+    def _postprocess_loop(self):
+        while True:
+            orig_l, output_ab, encode, with_ab, future = self._post_queue.get()
+            start = time.time()
+            try:
+                output_img = self.pipeline.postprocess(orig_l, output_ab)
+                if encode is not None:
+                    ok, encoded = cv2.imencode(encode, output_img)
+                    if not ok:
+                        raise ValueError(f"Unable to encode the colorized image as {encode}.")
+                    output_img = encoded.tobytes()
+                future.set_result((output_img, output_ab) if with_ab else output_img)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._stats["postprocess"].record(1, time.time() - start)
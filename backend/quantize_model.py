@@ -0,0 +1,137 @@
+import argparse
+import io
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from colorization_engine import ImageColorizationPipeline, benchmark, quantize_linears, sample_images, sample_inputs
+from colorization_pipeline import calculate_psnr
+
+
+def linear_groups(model):
+    """Names of the modules whose nn.Linear children are quantized together, e.g. one ConvNeXt block or FFN layer.
+
+    Attention projections are left out: their modules are not plain nn.Linear.
+    """
+    groups = []
+    for name, module in model.named_modules():
+        if type(module) is nn.Linear:
+            parent = name.rsplit(".", 1)[0]
+            if parent not in groups:
+                groups.append(parent)
+    return groups
+
+
+def mean_ab_error(pipeline, model_inputs, reference_ab):
+    return (pipeline.infer(model_inputs) - reference_ab).abs().mean().item()
+
+
+def calibrate(pipeline, model_inputs, tolerance):
+    """Picks the groups to quantize so the mean |dab| from fp32 on `model_inputs` stays within `tolerance`.
+
+    Every group is first quantized on its own to measure its error; groups are
+    then added from the least to the most sensitive, keeping each one only if
+    the error of everything chosen so far stays within the tolerance.
+    Returns the chosen group names and the error of each group on its own.
+    """
+    model = pipeline.base_model
+    reference_ab = pipeline.infer(model_inputs)
+
+    sensitivity = {}
+    for name in linear_groups(model):
+        original = model.get_submodule(name)
+        quantize_linears(model, [name])
+        sensitivity[name] = mean_ab_error(pipeline, model_inputs, reference_ab)
+        model.set_submodule(name, original)
+
+    chosen, originals = [], {}
+    for name in sorted(sensitivity, key=sensitivity.get):
+        originals[name] = model.get_submodule(name)
+        quantize_linears(model, [name])
+        if mean_ab_error(pipeline, model_inputs, reference_ab) <= tolerance:
+            chosen.append(name)
+        else:
+            model.set_submodule(name, originals[name])
+
+    for name in chosen:
+        model.set_submodule(name, originals[name])
+    return chosen, sensitivity
+
+
+def save_quantized(model, quantized_layers, output_path):
+    """Quantizes `quantized_layers` of an fp32 model in place and saves it in the format build_model loads."""
+    quantized = quantize_linears(model, quantized_layers)
+    torch.save({"params": quantized.state_dict(), "quantized_layers": quantized_layers}, output_path)
+
+
+def weights_mb(model):
+    """Serialized size of the model's weights in MB."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+
+def report(reference, pipelines, imgs, runs=5):
+    """Prints latency, weight size and colorization error versus `reference` for each named pipeline."""
+    model_inputs = np.stack([reference.preprocess(img)[1] for img in imgs])
+    reference_ab = reference.infer(model_inputs)
+    reference_outputs, _ = reference.process_batch(imgs)
+    reference_seconds = benchmark(reference, model_inputs, runs)
+
+    print(f"{'model':<10} {'ms/img':>9} {'speedup':>8} {'weights MB':>11} {'max |dab|':>10} {'mean |dab|':>11} "
+          f"{'PSNR dB':>8}")
+    for name, pipeline in pipelines.items():
+        seconds = reference_seconds if pipeline is reference else benchmark(pipeline, model_inputs, runs)
+        diff = (pipeline.infer(model_inputs) - reference_ab).abs()
+        outputs, _ = pipeline.process_batch(imgs)
+        psnr = np.mean([calculate_psnr(output / 255.0, reference_output / 255.0)
+                        for output, reference_output in zip(outputs, reference_outputs)])
+        print(f"{name:<10} {seconds / len(imgs) * 1000:>9.1f} {reference_seconds / seconds:>7.2f}x "
+              f"{weights_mb(pipeline.model):>11.1f} {diff.max().item():>10.4f} {diff.mean().item():>11.4f} "
+              f"{psnr:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate and save a dynamic int8 model for CPU serving")
+    parser.add_argument('--model_path', type=str, default='./pretrained_model.pt')
+    parser.add_argument('--output_path', type=str, default='./pretrained_model_int8.pt')
+    parser.add_argument('--input_size', type=int, default=512, help='input size for model')
+    parser.add_argument('--model_size', type=str, default='large', help='ddcolor model size')
+    parser.add_argument('--images', nargs='*', default=[], help='calibration images (default: synthetic)')
+    parser.add_argument('--eval_images', nargs='*', default=None, help='images for the report (default: --images)')
+    parser.add_argument('--num_images', type=int, default=8, help='calibration images used, padded with synthetic ones')
+    parser.add_argument('--tolerance', type=float, default=1.0,
+                        help='mean |dab| from fp32 allowed on the calibration images')
+    parser.add_argument('--all', action='store_true', help='quantize every linear layer without calibrating')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per model in the report')
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    # Unfrozen, so the saved weights keep the checkpoint layout build_model loads
+    pipeline = ImageColorizationPipeline(args.model_path, args.input_size, args.model_size, device=device, freeze=False)
+    groups = linear_groups(pipeline.base_model)
+    if args.all:
+        quantized_layers = groups
+    else:
+        start = time.time()
+        model_inputs = sample_inputs(pipeline, args.num_images, args.images)
+        quantized_layers, sensitivity = calibrate(pipeline, model_inputs, args.tolerance)
+        print(f"Calibrated on {len(model_inputs)} images in {time.time() - start:.1f} seconds.")
+        for name in sorted(sensitivity, key=sensitivity.get, reverse=True)[:5]:
+            print(f"  most sensitive: {name} (mean |dab| {sensitivity[name]:.4f} alone)")
+    print(f"Quantizing {len(quantized_layers)} of {len(groups)} linear groups.")
+
+    save_quantized(pipeline.base_model, quantized_layers, args.output_path)
+    print(f"Saved {args.output_path}; serve it like any checkpoint, on the CPU.")
+
+    reference = ImageColorizationPipeline(args.model_path, args.input_size, args.model_size, device=device)
+    quantized = ImageColorizationPipeline(args.output_path, args.input_size, args.model_size, device=device)
+    eval_images = args.images if args.eval_images is None else args.eval_images
+    report(reference, {"fp32": reference, "int8": quantized},
+           sample_images(args.input_size, args.num_images, eval_images), args.runs)
+
+
+if __name__ == '__main__':
+    main()
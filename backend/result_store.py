@@ -0,0 +1,159 @@
+import os
+import shutil
+import threading
+import time
+
+
+class ResultStore:
+    """Per-job result directories with a TTL and a global disk quota.
+
+    A job's directory expires `ttl_seconds` after it was last written or
+    fetched. While the store is over `quota_bytes`, the least recently used
+    finished jobs are evicted. Jobs that are still being written are never
+    evicted. A janitor thread sweeps every `janitor_interval` seconds.
+
+    Directories written by other processes, such as queue workers, are adopted
+    on their first fetch or sweep and aged from their newest file. While
+    `is_active(job_id)` says such a job is still queued or running, it is
+    treated like a job being written here and its age is reset.
+    """
+
+    def __init__(self, root, ttl_seconds=3600, quota_bytes=10 * 1024 ** 3, janitor_interval=60, on_evict=None,
+                 is_active=None):
+        self.root = os.path.abspath(root)
+        self.ttl_seconds = ttl_seconds
+        self.quota_bytes = quota_bytes
+        self.janitor_interval = janitor_interval
+        self.on_evict = on_evict
+        self.is_active = is_active
+        self.evicted = {"ttl": 0, "quota": 0}
+        self._last_access = {}
+        self._active = set()
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        # Results left by an earlier run are aged from their modification time
+        self._adopt_all()
+
+        threading.Thread(target=self._janitor_loop, daemon=True).start()
+
+    def create(self, job_id):
+        """Creates the directory of a job that is about to write results and returns it."""
+        path = os.path.join(self.root, job_id)
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._last_access[job_id] = time.time()
+            self._active.add(job_id)
+        return path
+
+    def finish(self, job_id):
+        """Marks a job's results as complete, making them eligible for eviction."""
+        with self._lock:
+            self._active.discard(job_id)
+            if job_id in self._last_access:
+                self._last_access[job_id] = time.time()
+
+    def job_dir(self, job_id):
+        """Directory of a stored job, refreshing its TTL, or None if it is gone."""
+        path = os.path.join(self.root, job_id)
+        with self._lock:
+            if job_id not in self._last_access and not os.path.isdir(path):
+                return None
+            self._last_access[job_id] = time.time()
+        return path
+
+    def exists(self, job_id):
+        """Whether a job has results in the store, including ones left by an earlier run or another process."""
+        with self._lock:
+            if job_id in self._last_access:
+                return True
+        return os.path.exists(os.path.join(self.root, job_id))
+
+    def remove(self, job_id):
+        with self._lock:
+            self._last_access.pop(job_id, None)
+            self._active.discard(job_id)
+        shutil.rmtree(os.path.join(self.root, job_id), ignore_errors=True)
+
+    def sweep(self):
+        """Evicts expired jobs, then least recently used ones while over quota."""
+        self._adopt_all()
+        now = time.time()
+        for last, job_id in self._idle_jobs():
+            if now - last > self.ttl_seconds and not self._active_elsewhere(job_id):
+                self._evict(job_id, "ttl")
+
+        usage = self.disk_usage()
+        for _, job_id in self._idle_jobs():
+            if usage <= self.quota_bytes:
+                break
+            if self._active_elsewhere(job_id):
+                continue
+            usage -= self._dir_size(os.path.join(self.root, job_id))
+            self._evict(job_id, "quota")
+
+    def disk_usage(self):
+        return sum(self._dir_size(os.path.join(self.root, job_id)) for job_id in list(self._last_access))
+
+    def stats(self):
+        with self._lock:
+            jobs, active = len(self._last_access), len(self._active)
+        return {
+            "jobs": jobs,
+            "active_jobs": active,
+            "disk_usage_mb": round(self.disk_usage() / (1024 ** 2), 1),
+            "quota_mb": round(self.quota_bytes / (1024 ** 2), 1),
+            "ttl_seconds": self.ttl_seconds,
+            "evicted": dict(self.evicted),
+        }
+
+    def _idle_jobs(self):
+        """(last access, job id) of the jobs not being written here, least recently used first."""
+        with self._lock:
+            return sorted((last, job_id) for job_id, last in self._last_access.items() if job_id not in self._active)
+
+    def _active_elsewhere(self, job_id):
+        """Whether another process is still writing the job; if so its age starts over."""
+        if self.is_active is None or not self.is_active(job_id):
+            return False
+        with self._lock:
+            if job_id in self._last_access:
+                self._last_access[job_id] = time.time()
+        return True
+
+    def _evict(self, job_id, reason):
+        self.remove(job_id)
+        self.evicted[reason] += 1
+        print(f"Evicted results of job {job_id} ({reason}).")
+        if self.on_evict is not None:
+            self.on_evict(job_id)
+
+    def _janitor_loop(self):
+        while True:
+            time.sleep(self.janitor_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error: result store sweep failed: {e}")
+
+    def _adopt_all(self):
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.name not in self._last_access:
+                try:
+                    last = max([entry.stat().st_mtime] + [f.stat().st_mtime for f in os.scandir(entry.path)])
+                except OSError:
+                    continue  # removed while scanning
+                with self._lock:
+                    self._last_access.setdefault(entry.name, last)
+
+    @staticmethod
+    def _dir_size(path):
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    pass  # removed while walking
+        return total
@@ -0,0 +1,84 @@
+import math
+import os
+
+import cv2
+
+
+class SegmentedVideoWriter:
+    """Writes frames as fixed-duration .mp4 segments plus an HLS-style .m3u8 playlist.
+
+    A segment is added to the playlist only once its `cv2.VideoWriter` has been
+    released, so clients polling the playlist never see a half-written file.
+    """
+
+    def __init__(self, output_dir, fps, segment_duration=4.0, playlist_name="playlist.m3u8"):
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        self.output_dir = output_dir
+        self.fps = fps
+        self.segment_duration = segment_duration
+        self.frames_per_segment = max(1, int(round(fps * segment_duration)))
+        self.playlist_path = os.path.join(output_dir, playlist_name)
+        self.segments = []  # (filename, duration in seconds)
+        self.frame_count = 0
+
+        self._fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self._writer = None
+        self._segment_name = None
+        self._segment_frames = 0
+        self._closed = False
+
+        # An empty playlist lets clients start polling before the first segment is done
+        self._write_playlist()
+
+    def write(self, frame):
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._segment_name = f"segment_{len(self.segments):05d}.mp4"
+            self._writer = cv2.VideoWriter(
+                os.path.join(self.output_dir, self._segment_name), self._fourcc, self.fps, (width, height))
+
+        self._writer.write(frame)
+        self._segment_frames += 1
+        self.frame_count += 1
+
+        if self._segment_frames == self.frames_per_segment:
+            self._finish_segment()
+
+    def close(self):
+        """Flushes the last, possibly shorter, segment and marks the playlist as complete."""
+        if self._closed:
+            return
+        self._finish_segment()
+        self._closed = True
+        self._write_playlist()
+
+    def _finish_segment(self):
+        if self._writer is None:
+            return
+        self._writer.release()
+        self.segments.append((self._segment_name, self._segment_frames / self.fps))
+        self._writer = None
+        self._segment_frames = 0
+        self._write_playlist()
+
+    def _write_playlist(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{math.ceil(self.segment_duration)}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for name, duration in self.segments:
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(name)
+        if self._closed:
+            lines.append("#EXT-X-ENDLIST")
+
+        # Replace atomically so a concurrent reader sees either the old or the new playlist
+        tmp_path = self.playlist_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.playlist_path)
@@ -0,0 +1,56 @@
+import threading
+
+import cv2
+import numpy as np
+
+
+class StaticFrameFilter:
+    """Spots video frames that repeat the last frame the model colorized.
+
+    Frames are compared on a `size` x `size` thumbnail of their Lab L channel.
+    A frame whose mean absolute L difference from the last model-colorized
+    frame is at most `threshold` (L runs from 0 to 100) is a duplicate. Comparing
+    against that frame rather than the immediately preceding one keeps a slow
+    fade from being skipped frame after frame.
+    """
+
+    def __init__(self, threshold=1.0, size=64):
+        self.threshold = threshold
+        self.size = size
+        self.frames = 0
+        self.skipped = 0
+        self._reference = None
+
+    def is_duplicate(self, frame):
+        """Whether `frame` can reuse the colors of the last non-duplicate frame; records it as such if not."""
+        self.frames += 1
+        small = cv2.resize(frame, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        l_channel = cv2.cvtColor((small / 255.0).astype(np.float32), cv2.COLOR_BGR2Lab)[:, :, 0]
+        if (self.threshold > 0 and self._reference is not None
+                and np.abs(l_channel - self._reference).mean() <= self.threshold):
+            self.skipped += 1
+            return True
+        self._reference = l_channel
+        return False
+
+
+class StaticFrameMetrics:
+    """Video frames seen and frames that skipped the model, across all jobs."""
+
+    def __init__(self):
+        self.frames = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def record(self, frame_filter):
+        with self._lock:
+            self.frames += frame_filter.frames
+            self.skipped += frame_filter.skipped
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "frames_skipped": self.skipped,
+                "skip_rate": round(self.skipped / self.frames, 3) if self.frames else 0.0,
+            }
@@ -0,0 +1,167 @@
+import collections
+import threading
+import time
+
+
+class StreamStats:
+    """Frame counters and latency/FPS tracking for one live stream."""
+
+    def __init__(self, window=30):
+        self.frames_in = 0
+        self.frames_out = 0
+        self.frames_dropped = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+        self.completed_at = collections.deque(maxlen=window)
+
+    def record(self, latency):
+        self.frames_out += 1
+        self.last_latency = latency
+        self.total_latency += latency
+        self.completed_at.append(time.time())
+
+    def fps(self):
+        if len(self.completed_at) < 2:
+            return 0.0
+        elapsed = self.completed_at[-1] - self.completed_at[0]
+        return (len(self.completed_at) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            "frames_in": self.frames_in,
+            "frames_out": self.frames_out,
+            "frames_dropped": self.frames_dropped,
+            "fps": round(self.fps(), 2),
+            "last_latency_ms": round(self.last_latency * 1000, 1),
+            "avg_latency_ms": round(self.total_latency / self.frames_out * 1000, 1) if self.frames_out else 0.0,
+        }
+
+
+class StreamSender:
+    """Delivers the colorized frames of one stream from its own thread.
+
+    Only the newest undelivered frame is kept, so a slow client drops stale
+    frames instead of holding up the batch thread or the other streams.
+    """
+
+    def __init__(self, stream_id, on_sent):
+        self.stream_id = stream_id
+        self._on_sent = on_sent
+        self._outbox = None  # (output, submitted_at, callback)
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, output, submitted_at, callback):
+        """Queues `output` for delivery; returns True if it replaced a frame not yet sent."""
+        with self._cond:
+            replaced = self._outbox is not None
+            self._outbox = (output, submitted_at, callback)
+            self._cond.notify()
+            return replaced
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._outbox = None
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._outbox is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                output, submitted_at, callback = self._outbox
+                self._outbox = None
+
+            try:
+                callback(output)
+            except Exception as e:
+                print(f"Error: could not deliver frame to stream {self.stream_id}: {e}")
+                continue
+            self._on_sent(self.stream_id, submitted_at)
+
+
+class StreamBatcher:
+    """Colorizes frames pushed by live streams.
+
+    Only the newest pending frame of each stream is kept, so a slow model drops
+    stale frames instead of building up latency. Pending frames of all streams
+    are colorized together in one batched forward pass, and each stream's
+    results are sent by its own StreamSender, so a slow client only delays itself.
+    """
+
+    def __init__(self, pipeline, max_batch_size=8):
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self._pending = {}  # stream_id -> (frame, submitted_at, callback)
+        self._stats = {}
+        self._senders = {}
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def open_stream(self, stream_id):
+        with self._cond:
+            self._stats[stream_id] = StreamStats()
+            self._senders[stream_id] = StreamSender(stream_id, self._record_sent)
+
+    def close_stream(self, stream_id):
+        with self._cond:
+            self._pending.pop(stream_id, None)
+            self._stats.pop(stream_id, None)
+            sender = self._senders.pop(stream_id, None)
+        if sender is not None:
+            sender.close()
+
+    def submit(self, stream_id, frame, callback):
+        """Queues `frame` for `stream_id`, replacing any frame not yet colorized.
+
+        `callback(colorized_frame)` is called from the stream's sender thread; the
+        recorded latency covers submission up to the end of the callback.
+        """
+        with self._cond:
+            stats = self._stats[stream_id]
+            stats.frames_in += 1
+            if stream_id in self._pending:
+                stats.frames_dropped += 1
+            self._pending[stream_id] = (frame, time.time(), callback)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {stream_id: stats.to_dict() for stream_id, stats in self._stats.items()}
+
+    def _record_sent(self, stream_id, submitted_at):
+        with self._cond:
+            stats = self._stats.get(stream_id)
+            if stats is not None:  # the stream may have closed while its frame was being sent
+                stats.record(time.time() - submitted_at)
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Oldest submissions first, so no stream waits more than one batch
+            stream_ids = sorted(self._pending, key=lambda s: self._pending[s][1])[:self.max_batch_size]
+            return [(stream_id, *self._pending.pop(stream_id)) for stream_id in stream_ids]
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                outputs, _ = self.pipeline.process_batch([frame for _, frame, _, _ in batch], self.max_batch_size)
+            except Exception as e:
+                print(f"Error: stream batch failed: {e}")
+                continue
+
+            with self._cond:
+                for (stream_id, _, submitted_at, callback), output in zip(batch, outputs):
+                    sender = self._senders.get(stream_id)
+                    if sender is None:  # the stream closed while its frame was in the model
+                        continue
+                    if sender.put(output, submitted_at, callback):
+                        self._stats[stream_id].frames_dropped += 1
@@ -0,0 +1,61 @@
+import torch
+
+# sRGB (D65) <-> XYZ matrices and white point used by OpenCV's Lab conversions
+RGB_TO_XYZ = (
+    (0.412453, 0.357580, 0.180423),
+    (0.212671, 0.715160, 0.072169),
+    (0.019334, 0.119193, 0.950227),
+)
+XYZ_TO_RGB = (
+    (3.240479, -1.53715, -0.498535),
+    (-0.969256, 1.875991, 0.041556),
+    (0.055648, -0.204043, 1.057311),
+)
+WHITE_X, WHITE_Z = 0.950456, 1.088754
+EPSILON = 0.008856  # (6/29)^3
+KAPPA = 903.3
+
+
+def _matrix(values, like):
+    return torch.tensor(values, dtype=like.dtype, device=like.device)
+
+
+def _srgb_to_linear(v):
+    return torch.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(v):
+    return torch.where(v <= 0.0031308, v * 12.92, 1.055 * v.clamp(min=0.0031308) ** (1 / 2.4) - 0.055)
+
+
+def _f(t):
+    return torch.where(t > EPSILON, t.clamp(min=EPSILON) ** (1 / 3), 7.787 * t + 16 / 116)
+
+
+def _f_inverse(t):
+    return torch.where(t > 6 / 29, t ** 3, (t - 16 / 116) / 7.787)
+
+
+def bgr_to_lab(bgr):
+    """(n, 3, h, w) float BGR in [0, 1] to Lab with L in [0, 100], like cv2.COLOR_BGR2Lab on float32 images."""
+    rgb = _srgb_to_linear(bgr.flip(1))
+    xyz = torch.einsum("ij,njhw->nihw", _matrix(RGB_TO_XYZ, rgb), rgb)
+    x, y, z = xyz[:, 0] / WHITE_X, xyz[:, 1], xyz[:, 2] / WHITE_Z
+    fx, fy, fz = _f(x), _f(y), _f(z)
+    l_channel = torch.where(y > EPSILON, 116 * fy - 16, KAPPA * y)
+    return torch.stack((l_channel, 500 * (fx - fy), 200 * (fy - fz)), dim=1)
+
+
+def lab_to_rgb(lab):
+    """(n, 3, h, w) Lab to float RGB in [0, 1], like cv2.COLOR_Lab2RGB on float32 images."""
+    l_channel, a, b = lab[:, 0], lab[:, 1], lab[:, 2]
+    fy = (l_channel + 16) / 116
+    y = torch.where(l_channel <= 8, l_channel / KAPPA, fy ** 3)
+    fy = torch.where(l_channel <= 8, 7.787 * y + 16 / 116, fy)
+    xyz = torch.stack((WHITE_X * _f_inverse(fy + a / 500), y, WHITE_Z * _f_inverse(fy - b / 200)), dim=1)
+    rgb = torch.einsum("ij,njhw->nihw", _matrix(XYZ_TO_RGB, xyz), xyz)
+    return _linear_to_srgb(rgb.clamp(0, 1))
+
+
+def lab_to_bgr(lab):
+    return lab_to_rgb(lab).flip(1)
@@ -0,0 +1,209 @@
+import struct
+import threading
+import time
+
+import cv2
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class UploadIngest:
+    """Streams a request body to a file chunk by chunk and tracks how much has arrived.
+
+    Nothing is buffered beyond one chunk, the size cap is enforced while the data
+    is arriving, and readers can wait for more bytes while the upload is running.
+    For MP4 uploads the top-level boxes are scanned as they arrive, so a reader
+    can tell when the `moov` index is complete ahead of the `mdat` payload.
+    """
+
+    def __init__(self, stream, path, content_length=None, max_bytes=None, chunk_size=1 << 20):
+        self.stream = stream
+        self.path = path
+        self.content_length = content_length
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+
+        self.bytes_written = 0
+        self.done = False
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+        self.moov_received = False
+        self.mdat_offset = None  # start of the media payload, once known
+        self._next_box = 0
+        self._box_end = 8  # bytes needed on disk before the next box can be read further
+        self._cond = threading.Condition()
+
+    def run(self):
+        """Copies the stream to `path`; runs in the request thread."""
+        if self.max_bytes is not None and self.content_length is not None and self.content_length > self.max_bytes:
+            self._finish(UploadTooLarge(f"Upload of {self.content_length} bytes exceeds the {self.max_bytes} byte limit."))
+            raise self.error
+
+        self.started_at = time.time()
+        try:
+            with open(self.path, "wb") as f:
+                while True:
+                    chunk = self.stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    if self.max_bytes is not None and self.bytes_written + len(chunk) > self.max_bytes:
+                        raise UploadTooLarge(f"Upload exceeds the {self.max_bytes} byte limit.")
+                    f.write(chunk)
+                    f.flush()
+                    with self._cond:
+                        self.bytes_written += len(chunk)
+                        self._scan_boxes()
+                        self._cond.notify_all()
+        except Exception as e:
+            self._finish(e)
+            raise
+        self._finish(None)
+
+    def throughput(self):
+        """Ingest rate in bytes per second."""
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.bytes_written / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return {
+            "bytes": self.bytes_written,
+            "seconds": round((self.finished_at or time.time()) - (self.started_at or time.time()), 3),
+            "mb_per_second": round(self.throughput() / (1 << 20), 2),
+        }
+
+    def payload_fraction(self):
+        """Fraction of the `mdat` payload received so far, or None if it cannot be estimated."""
+        if self.done:
+            return 1.0
+        if self.mdat_offset is None or not self.content_length or self.content_length <= self.mdat_offset:
+            return None
+        return (self.bytes_written - self.mdat_offset) / (self.content_length - self.mdat_offset)
+
+    def wait(self, predicate, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.done or predicate(), timeout=timeout)
+
+    def wait_for_more(self, seen_bytes, timeout=1.0):
+        return self.wait(lambda: self.bytes_written > seen_bytes, timeout=timeout)
+
+    def _finish(self, error):
+        with self._cond:
+            self.error = error
+            self.done = True
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def _scan_boxes(self):
+        # Walk the MP4 top-level boxes that are fully described by the bytes on disk;
+        # the file is only opened once enough has arrived to get past the current box
+        if self.mdat_offset is not None or self.bytes_written < self._box_end:
+            return
+        with open(self.path, "rb") as f:
+            while self._next_box + 8 <= self.bytes_written:
+                f.seek(self._next_box)
+                size, box_type = struct.unpack(">I4s", f.read(8))
+                if size == 1:
+                    if self._next_box + 16 > self.bytes_written:
+                        self._box_end = self._next_box + 16
+                        return
+                    size, = struct.unpack(">Q", f.read(8))
+                if box_type == b"mdat":
+                    self.mdat_offset = self._next_box
+                    return
+                if size < 8:
+                    self._box_end = float("inf")  # a box running to the end of the file; nothing follows it
+                    return
+                if self._next_box + size > self.bytes_written:
+                    self._box_end = self._next_box + size
+                    return
+                if box_type == b"moov":
+                    self.moov_received = True
+                self._next_box += size
+            self._box_end = self._next_box + 8
+
+
+class ProgressiveVideoReader:
+    """Decodes frames from an upload that is still arriving.
+
+    Frames are read ahead of the upload only for MP4 files whose `moov` index
+    precedes the media payload ("faststart"); decoding starts once
+    `probe_bytes` of payload are present (FFmpeg's default probe size) and
+    stays `margin_seconds` of video behind the estimated position of the
+    received bytes. Any other file is decoded once the upload has finished.
+    """
+
+    def __init__(self, ingest, margin_seconds=1.0, probe_bytes=5 * 1000 * 1000):
+        self.ingest = ingest
+        self.margin_seconds = margin_seconds
+        self.probe_bytes = probe_bytes
+        self.fps = None
+        self.frame_count = 0
+        self._cap = None
+        self._cap_complete = False
+        self._next_frame = 0
+
+    def open(self):
+        """Waits until the upload can be decoded and returns the video frame rate."""
+        self.ingest.wait(lambda: (self.ingest.moov_received and self.ingest.payload_fraction() is not None
+                                  and self.ingest.bytes_written - self.ingest.mdat_offset >= self.probe_bytes))
+        if self.ingest.error is not None:
+            raise self.ingest.error
+
+        self._open_capture()
+        if not self._cap.isOpened():
+            raise ValueError(f"Error: Could not open video {self.ingest.path}.")
+        self.fps = self._cap.get(cv2.CAP_PROP_FPS) or 30
+        self.frame_count = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        return self.fps
+
+    def __iter__(self):
+        try:
+            while True:
+                done = self.ingest.done
+                if self.ingest.error is not None:
+                    raise self.ingest.error
+                if self._cap is None:
+                    self._open_capture()
+
+                limit = None if done else self._safe_frame_limit()
+                seen_bytes = self.ingest.bytes_written
+                while limit is None or self._next_frame < limit:
+                    ret, frame = self._cap.read()
+                    if not ret:
+                        break
+                    self._next_frame += 1
+                    yield frame
+                else:
+                    # Caught up with the upload
+                    self.ingest.wait_for_more(seen_bytes)
+                    continue
+
+                # The decoder hit the end of the data it could see
+                complete = self._cap_complete
+                self._cap.release()
+                self._cap = None
+                if complete:
+                    return
+                if not done:
+                    self.ingest.wait_for_more(seen_bytes)
+        finally:
+            if self._cap is not None:
+                self._cap.release()
+
+    def _open_capture(self):
+        self._cap_complete = self.ingest.done
+        self._cap = cv2.VideoCapture(self.ingest.path)
+        if self._next_frame:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, self._next_frame)
+
+    def _safe_frame_limit(self):
+        fraction = self.ingest.payload_fraction()
+        if fraction is None:
+            return 0
+        return int(self.frame_count * fraction - self.margin_seconds * self.fps)
@@ -0,0 +1,183 @@
+import argparse
+import functools
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+import cv2
+
+from colorization_engine import BACKENDS, PRECISIONS, ImageColorizationPipeline
+from colorization_pipeline import colorize_files
+from job_control import CancelToken, JobCancelled
+from job_queue import JobQueue
+from static_frames import StaticFrameFilter
+
+
+class InvalidInput(ValueError):
+    """An input a job can never process, such as an undecodable file; the job fails without retries."""
+
+
+def colorize_video_job(colorizer, payload, token, static_frame_threshold=1.0, batch_size=4):
+    """Colorizes payload["input"] into colorized_video.mp4 in payload["output_dir"], `batch_size` frames at a time.
+
+    Frames that repeat the last colorized one reuse its ab prediction instead of running the model.
+    """
+    cap = cv2.VideoCapture(payload["input"])
+    if not cap.isOpened():
+        raise InvalidInput(f"Unable to open video {payload['input']}.")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    os.makedirs(payload["output_dir"], exist_ok=True)
+    output_path = os.path.join(payload["output_dir"], "colorized_video.mp4")
+    # Written under a temporary name, so a retried or abandoned attempt never looks finished
+    partial_path = output_path + ".part.mp4"
+    out = cv2.VideoWriter(partial_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+
+    frame_filter = StaticFrameFilter(static_frame_threshold)
+    output_ab = None
+    try:
+        while True:
+            token.check()
+            chunk = []  # (frame, is duplicate)
+            while len(chunk) < batch_size:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                chunk.append((frame, frame_filter.is_duplicate(frame)))
+            if not chunk:
+                break
+
+            model_abs = iter(colorizer.predict_abs([frame for frame, duplicate in chunk if not duplicate], batch_size))
+            for frame, duplicate in chunk:
+                if not duplicate:
+                    output_ab = next(model_abs)
+                out.write(colorizer.apply_ab(frame, output_ab))
+    except Exception:
+        out.release()
+        os.remove(partial_path)
+        raise
+    finally:
+        cap.release()
+        out.release()
+
+    os.replace(partial_path, output_path)
+    return {"frames": frame_filter.frames, "frames_skipped": frame_filter.skipped, "outputs": ["colorized_video.mp4"]}
+
+
+def colorize_album_job(colorizer, payload, token, batch_size=4):
+    """Colorizes every image of payload["inputs"] into a PNG in payload["output_dir"].
+
+    Near-duplicates share one model run when payload["dedup_threshold"] is set.
+    Each batch is written as soon as it is done, so memory does not grow with the album.
+    """
+    input_paths = payload["inputs"]
+    filenames = [os.path.splitext(os.path.basename(input_path))[0] + ".png" for input_path in input_paths]
+    os.makedirs(payload["output_dir"], exist_ok=True)
+
+    def write_output(index, output_img):
+        if output_img is None:
+            raise InvalidInput(f"Unable to read image {input_paths[index]}.")
+        cv2.imwrite(os.path.join(payload["output_dir"], filenames[index]), output_img)
+
+    report = colorize_files(colorizer, input_paths, write_output, payload.get("dedup_threshold"), token=token,
+                            batch_size=batch_size)
+    return {"images": len(filenames), "inference_runs": report["inference_runs"],
+            "inference_reduction": report["inference_reduction"], "outputs": filenames}
+
+
+JOB_HANDLERS = {
+    "video": colorize_video_job,
+    "album": colorize_album_job,
+}
+
+
+def keep_lease(queue, job_id, worker_id, token, done):
+    """Heartbeats until `done` is set; cancels `token` once the lease is lost."""
+    while not done.wait(queue.lease_seconds / 3):
+        if not queue.heartbeat(job_id, worker_id):
+            token.cancel("lease lost")
+            return
+
+
+def remove_inputs(payload):
+    for input_path in payload.get("inputs", [payload.get("input")]):
+        if input_path and os.path.exists(input_path):
+            os.remove(input_path)
+
+
+def run_job(queue, colorizer, job, worker_id):
+    token = CancelToken()
+    done = threading.Event()
+    threading.Thread(target=keep_lease, args=(queue, job["id"], worker_id, token, done), daemon=True).start()
+
+    start = time.time()
+    try:
+        result = JOB_HANDLERS[job["kind"]](colorizer, job["payload"], token)
+    except JobCancelled as e:
+        # The job was cancelled or handed to another worker; nothing to report
+        print(f"Job {job['id']} abandoned: {e}")
+        return
+    except Exception as e:
+        print(f"Error: job {job['id']} failed: {e}")
+        if queue.fail(job["id"], worker_id, e, retry=not isinstance(e, InvalidInput)) == "failed":
+            # No attempt follows, so neither the uploads nor the partial outputs are needed
+            remove_inputs(job["payload"])
+            shutil.rmtree(job["payload"]["output_dir"], ignore_errors=True)
+        return
+    finally:
+        done.set()
+
+    result["seconds"] = round(time.time() - start, 2)
+    if queue.complete(job["id"], worker_id, result):
+        remove_inputs(job["payload"])
+        print(f"Job {job['id']} done in {result['seconds']} seconds.")
+
+
+def run_worker(queue, colorizer, worker_id, poll_interval=1.0):
+    print(f"Worker {worker_id} polling {queue.path}.")
+    while True:
+        job = queue.lease(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        print(f"Worker {worker_id} leased {job['kind']} job {job['id']} (attempt {job['attempts']}).")
+        run_job(queue, colorizer, job, worker_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Colorization queue worker")
+    parser.add_argument('--queue', type=str, default='jobs.db', help='path of the shared SQLite job queue')
+    parser.add_argument('--model_path', type=str, default='./pretrained_model.pt')
+    parser.add_argument('--input_size', type=int, default=512, help='input size for model')
+    parser.add_argument('--model_size', type=str, default='large', help='ddcolor model size')
+    parser.add_argument('--backend', type=str, default='eager', choices=list(BACKENDS), help='model execution backend')
+    parser.add_argument('--precision', type=str, default='fp32', choices=list(PRECISIONS), help='inference precision')
+    parser.add_argument('--channels_last', action='store_true', help='run the model in the channels-last memory format')
+    parser.add_argument('--worker_id', type=str, default=f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}")
+    parser.add_argument('--lease_seconds', type=int, default=60, help='lease length; heartbeats every third of it')
+    parser.add_argument('--max_attempts', type=int, default=3, help='attempts before a job is marked failed')
+    parser.add_argument('--poll_interval', type=float, default=1.0, help='seconds between polls of an empty queue')
+    parser.add_argument('--batch_size', type=int, default=4, help='images or video frames per model forward')
+    parser.add_argument('--static_frame_threshold', type=float, default=1.0,
+                        help='mean L difference (0-100) under which a video frame reuses the previous colors; 0 disables')
+    parser.add_argument('--no_wal', action='store_true', help='disable WAL mode, for a queue on network storage')
+    args = parser.parse_args()
+    JOB_HANDLERS["video"] = functools.partial(colorize_video_job, static_frame_threshold=args.static_frame_threshold,
+                                              batch_size=args.batch_size)
+    JOB_HANDLERS["album"] = functools.partial(colorize_album_job, batch_size=args.batch_size)
+
+    queue = JobQueue(args.queue, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts,
+                     wal=not args.no_wal)
+    colorizer = ImageColorizationPipeline(model_path=args.model_path, input_size=args.input_size,
+                                          model_size=args.model_size, backend=args.backend, precision=args.precision,
+                                          channels_last=args.channels_last)
+    run_worker(queue, colorizer, args.worker_id, args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()